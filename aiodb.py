@@ -0,0 +1,71 @@
+import asyncio
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import mysettings as s
+
+_local = threading.local()
+_executor = ThreadPoolExecutor(max_workers=s.DB_POOL_SIZE, thread_name_prefix="aiodb")
+
+
+def _dict_factory(cursor, row) -> dict:
+    return {col[0]: v for col, v in zip(cursor.description, row)}
+
+
+def _get_conn() -> sqlite3.Connection:
+    """Connection of the current pool thread. Created on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(
+            s.DB_PATH, timeout=s.DB_BUSY_TIMEOUT, isolation_level=None
+        )
+        conn.row_factory = _dict_factory
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(f"PRAGMA busy_timeout = {int(s.DB_BUSY_TIMEOUT * 1000)}")
+        _local.conn = conn
+    return conn
+
+
+def _q(sql: str, params) -> list[dict]:
+    return _get_conn().execute(sql, params).fetchall()
+
+
+def _execute(sql: str, params) -> int:
+    return _get_conn().execute(sql, params).lastrowid
+
+
+def _transaction(statements) -> None:
+    conn = _get_conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for sql, params in statements:
+            conn.execute(sql, params)
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+async def q(sql: str, params: tuple | list = ()) -> list[dict]:
+    """Run select query on the db thread pool. Return rows as dicts."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _q, sql, tuple(params))
+
+
+async def first(sql: str, params: tuple | list = ()) -> dict | None:
+    rows = await q(sql, params)
+    return rows[0] if rows else None
+
+
+async def execute(sql: str, params: tuple | list = ()) -> int:
+    """Run write statement on the db thread pool. Return lastrowid."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _execute, sql, tuple(params))
+
+
+async def transaction(*statements: tuple[str, tuple | list]) -> None:
+    """Run (sql, params) write statements in one transaction on the pool."""
+    loop = asyncio.get_running_loop()
+    statements = [(sql, tuple(params)) for sql, params in statements]
+    await loop.run_in_executor(_executor, _transaction, statements)
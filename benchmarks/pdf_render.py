@@ -0,0 +1,69 @@
+"""
+Time pdf_builder.render_pdf per pdf with the process wide asset registry
+against the previous behaviour: font and styles rebuilt for every pdf and
+images embedded ASCII85 encoded.
+
+Run from the project root: python benchmarks/pdf_render.py [n_properties]
+"""
+
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.getcwd())
+
+import const  # noqa: E402
+import pdf_builder  # noqa: E402
+from reportlab import rl_config  # noqa: E402
+from tables import UnitsTable  # noqa: E402
+
+ROUNDS = 5
+
+
+def sample_data(n: int) -> tuple:
+    """Comparisons table shaped like components.get_units_tbl output."""
+    rows = {
+        "Nome": [f"Condominio {i}" for i in range(n)],
+        "Endereço": [f"Centro - Limeira {i}" for i in range(n)],
+        "Area, m2": [1000 * (i + 1) for i in range(n)],
+        **{f"Campo {k}": [k * i for i in range(n)] for k in range(10)},
+    }
+    tbl = UnitsTable(list(rows), [[str(v) for v in row] for row in rows.values()])
+    locations = [
+        {"index": i + 1, "location": {"lat": -22.5 - i / 10, "lng": -47.4}}
+        for i in range(n)
+    ]
+    img = "/imgs/default_image.jpg"
+    db_imgs = [{"img": ",".join([img] * 3), "infr": "Porto,Rodovia"}] * n
+    return tbl, locations, db_imgs
+
+
+def legacy_init() -> None:
+    """Registry rebuilt for every pdf, as create_pdf did before."""
+    pdf_builder._assets.clear()
+    warm_init()
+    rl_config.useA85 = 1
+
+
+def bench(init, data: tuple) -> float:
+    pdf_builder.init_assets = init
+    pdf_builder._assets.clear()
+    pdf_builder.render_pdf(*data, io.BytesIO())  # first pdf of the process
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        pdf_builder.render_pdf(*data, io.BytesIO())
+    return (time.perf_counter() - start) / ROUNDS
+
+
+if __name__ == "__main__":
+    if not os.path.exists(const.static_map_image):
+        # the static map is generated outside of the repo
+        const.static_map_image = const.BODY_BGD
+    data = sample_data(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
+    warm_init = pdf_builder.init_assets
+    legacy = bench(legacy_init, data)
+    warm = bench(warm_init, data)
+    print(f"per pdf before: {legacy * 1000:.0f} ms")
+    print(f"per pdf warm:   {warm * 1000:.0f} ms")
+    print(f"saving:         {(legacy - warm) * 1000:.0f} ms ({1 - warm / legacy:.0%})")
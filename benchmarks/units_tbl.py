@@ -0,0 +1,87 @@
+"""
+Time components.get_units_tbl against the previous pandas implementation
+for the property page (edit) and the comparisons table (select, details).
+
+Run from the project root: python benchmarks/units_tbl.py [n_units]
+pandas is not a dependency of the app anymore, install it for this script.
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.getcwd())
+
+import components as c  # noqa: E402
+import mysettings as s  # noqa: E402
+import pandas as pd  # noqa: E402
+
+ROUNDS = 200
+
+
+async def pandas_units_tbl(
+    db_q, ppt_type: int, ad_type: int | None, *flds, for_comparison: bool = False
+):
+    """get_units_tbl before the pandas removal."""
+    df = pd.DataFrame(db_q)
+    bool_flds = (
+        list(s.WH_BOOL_FLDS)
+        if ppt_type == s.PropertyType.WAREHOUSE
+        else ["under_construction"]
+    )
+    df[bool_flds] = df[bool_flds].replace({1: "Sim", 0: "Não"})
+    flds_list = c.get_tbl_flds_for(ppt_type, ad_type, *flds)
+    modification_dict = c.get_modification_dict(for_comparison)
+    for k in flds_list:
+        if modification_dict.get(k):
+            df[k] = df.apply(modification_dict[k], axis=1)
+    rename_dict = await c.get_renamed_flds_for(ppt_type, price_per_month=True)
+    return df[flds_list].rename(columns=rename_dict).transpose()
+
+
+def sample_units(n: int) -> list[dict]:
+    """Warehouse unit rows with the columns get_units_tbl reads."""
+    keys = c.get_tbl_flds_for(s.PropertyType.WAREHOUSE, None, "name")
+    keys += [f"{m}_{k}" for k in s.WH_MD_FLDS for m in ("min", "max")]
+    return [
+        {
+            **{k: i * 10 + j for j, k in enumerate(keys)},
+            **{k: i % 2 for k in s.WH_BOOL_FLDS},
+            "id": i + 1,
+            "ppt_id": 1,
+            "title": f"M{i}",
+            "district": "Centro",
+            "city": "Limeira",
+        }
+        for i in range(n)
+    ]
+
+
+async def bench(fn, db_q, *flds, **kwargs) -> float:
+    await fn(db_q, s.PropertyType.WAREHOUSE, None, *flds, **kwargs)
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        await fn(db_q, s.PropertyType.WAREHOUSE, None, *flds, **kwargs)
+    return (time.perf_counter() - start) / ROUNDS
+
+
+async def main(n: int) -> None:
+    db_q = sample_units(n)
+    cases = {
+        "property page": (("edit",), {}),
+        "comparisons": (
+            ("select", "details", "address", "name"),
+            {"for_comparison": True},
+        ),
+    }
+    for name, (flds, kwargs) in cases.items():
+        old = await bench(pandas_units_tbl, db_q, *flds, **kwargs)
+        new = await bench(c.get_units_tbl, db_q, *flds, **kwargs)
+        print(f"{name}, {n} units:")
+        print(f"  pandas:      {old * 1000:.2f} ms")
+        print(f"  UnitsTable:  {new * 1000:.2f} ms ({old / new:.0f}x)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5))
@@ -0,0 +1,82 @@
+import asyncio
+import os
+import re
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import aiodb
+import images
+import mysettings as s
+
+# Uploaded photos are stored once per content as imgs/{sha[:2]}/{sha}{ext}.
+# ppt_images rows reference blobs by name, the blob is removed with the
+# last row. Blob files never change, so they are cached for good.
+_blob_re = re.compile(r"[0-9a-f]{2}/([0-9a-f]{64})(\.[a-z]+)*\.[a-z0-9]+")
+_exts = {".jpeg": ".jpg"}
+# uploads and releases of the same blob run one at a time
+_locks: dict[str, asyncio.Lock] = {}
+_lock_users: dict[str, int] = {}
+
+
+def is_blob(path: str) -> bool:
+    """Whether the path relative to imgs/ is a blob or one of its variants."""
+    return _blob_re.fullmatch(path) is not None
+
+
+def get_ext(filename: str) -> str:
+    ext = Path(filename).suffix.lower()
+    if not ext[1:].isalnum():
+        return ""
+    return _exts.get(ext, ext)
+
+
+def get_name(sha256: str, ext: str) -> str:
+    """/imgs name of the blob of the content."""
+    return f"/imgs/{sha256[:2]}/{sha256}{ext}"
+
+
+@asynccontextmanager
+async def lock(name: str):
+    """
+    Hold the blob while its file and ppt_images rows change, so a release
+    does not remove a blob an upload is adding a row for.
+    """
+    _lock_users[name] = _lock_users.get(name, 0) + 1
+    try:
+        async with _locks.setdefault(name, asyncio.Lock()):
+            yield
+    finally:
+        _lock_users[name] -= 1
+        if not _lock_users[name]:
+            del _lock_users[name], _locks[name]
+
+
+def put(src: Path, name: str) -> None:
+    """
+    Move the uploaded file src into the store as the blob name.
+    If the blob already exists src is removed.
+    """
+    dst = s.BASE_DIR / name[1:]
+    dst.parent.mkdir(exist_ok=True)
+    if dst.exists():
+        src.unlink()
+    else:
+        os.replace(src, dst)
+
+
+async def refs(name: str) -> int:
+    """Number of ppt_images rows referencing the file."""
+    qry = "SELECT COUNT(*) AS n FROM ppt_images WHERE name = ?"
+    return (await aiodb.first(qry, (name,)))["n"]
+
+
+async def release(name: str, variants: list[str]) -> None:
+    """
+    Remove the file and its variants, the names of ppt_image_variants rows,
+    if no ppt_images row references it.
+    """
+    if await refs(name):
+        return
+    path = s.BASE_DIR / name[1:]
+    path.unlink(missing_ok=True)
+    images.delete_variants(path, [s.BASE_DIR / v[1:] for v in variants])
@@ -0,0 +1,46 @@
+import hashlib
+import re
+from pathlib import Path
+
+import compression
+import const
+import fasthtml.common as fh
+import mysettings as s
+
+# Scripts in js/ are served as /js/{name}.{hash}.js, the hash of the file
+# content is computed at startup. A changed file gets a new url, so
+# fingerprinted names are cached by browsers for good.
+_fingerprint_re = re.compile(r"(.+)\.[0-9a-f]{12}(\.js)")
+
+
+def _fingerprint(path: Path) -> str:
+    digest = hashlib.sha256(path.read_bytes()).hexdigest()[:12]
+    return f"{path.stem}.{digest}{path.suffix}"
+
+
+_names = {p.name: _fingerprint(p) for p in sorted(s.JS_DIR.glob("*.js"))}
+# changes with any script, part of validators of full pages
+version = hashlib.sha256(" ".join(_names.values()).encode()).hexdigest()[:12]
+
+
+def url(name: str) -> str:
+    """Fingerprinted url of the js/ script."""
+    return f"/js/{_names[name]}"
+
+
+def script(name: str) -> fh.Script:
+    """Module script tag of the js/ script."""
+    return fh.Script(type="module", src=url(name))
+
+
+class BundleFiles(compression.PrecompressedFiles):
+    """js/ scripts, fingerprinted names are cached for good."""
+
+    async def get_response(self, path: str, scope):
+        m = _fingerprint_re.fullmatch(path)
+        # a stale fingerprint still gets the current file, cached as usual
+        name = m[1] + m[2] if m else path
+        res = await super().get_response(name, scope)
+        if _names.get(name) == path and res.status_code in (200, 304):
+            res.headers["Cache-Control"] = const.IMMUTABLE_CACHE
+        return res
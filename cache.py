@@ -0,0 +1,27 @@
+from collections import OrderedDict
+
+# Process wide caches of rendered fragments. Every entry is stored with
+# the version of its data, like ppt_versions.version of the property, and
+# is a miss once the version changed. Least recently used are dropped.
+# Fragments are rendered with fh.to_xml, outside of the response, so they
+# need literal hx_get="/path" attributes, get="route_name" is not resolved.
+
+
+class FragmentCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._items: OrderedDict = OrderedDict()
+
+    def get(self, key, version):
+        """Value stored for the key with this version or None."""
+        item = self._items.get(key)
+        if item is None or item[0] != version:
+            return None
+        self._items.move_to_end(key)
+        return item[1]
+
+    def put(self, key, version, value) -> None:
+        self._items[key] = (version, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
@@ -1,65 +1,192 @@
 import asyncio
-import json
+import hashlib
+import math
+import operator
+import uuid
 from collections import ChainMap
 from datetime import datetime as dt
+from pathlib import Path
 
+import aiodb
+import aiofiles
 import aiofiles.os
+import blobs
+import cache
 import const
 import fasthtml.common as fh
+import images
+import lookups
 import mysettings as s
-import pandas as pd
-from reportlab.lib import colors
-from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfgen import canvas
-from reportlab.platypus import Paragraph, Table, TableStyle
+import pdf_cache
+from tables import UnitsTable
 
 _blank = dict(target="_blank", rel="noopener noreferrer")
 _flex = "display: flex; flex-wrap: wrap; align-content: flex-start; gap: 1em;"
 _grid = "display: grid; gap: 1.5rem; grid-template-columns: 1fr 1fr 1fr"
 
 
+class UploadTooLarge(ValueError):
+    """Uploaded file is bigger than const.UPLOAD_MAX_BYTES allow."""
+
+
+async def write_upload(upload, dst: Path, max_bytes: int) -> str:
+    """
+    Copy the upload to dst in chunks, memory use does not depend on the file
+    size. Return sha256 of the file. dst appears only when fully written.
+    """
+    sha = hashlib.sha256()
+    size = 0
+    tmp = dst.with_name(f".{dst.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        async with aiofiles.open(tmp, "wb") as f:
+            while chunk := await upload.read(const.UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(upload.filename)
+                sha.update(chunk)
+                await f.write(chunk)
+        await aiofiles.os.replace(tmp, dst)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return sha.hexdigest()
+
+
 async def save_item(path: str, ppt_id: int, item):
     if path == "infrs":
-        infr = {"name": item, "id": get_or_create("infr_id", item)}
+        infr = {"name": item, "id": lookups.get_or_create("infr_id", item)}
         s.ppt_infrastructures.insert(ppt_id=ppt_id, infr_id=infr["id"])
         return infr
     # logic for pdf and images
-    item_filename = f"{ppt_id}_{item.filename}"
     tbl = s.FILE_TABLES[path]
+    max_bytes = const.UPLOAD_MAX_BYTES[path]
     if path == "pdfs":
-        item_path = s.PDF_DIR / item_filename
+        item_filename = f"{ppt_id}_{item.filename}"
+        sha256 = await write_upload(item, s.PDF_DIR / item_filename, max_bytes)
+        _path = f"/{path}/{item_filename}"
     else:
-        item_path = s.IMG_DIR / item_filename
-    # Save file to the server
-    with item_path.open("wb") as f:
-        f.write(await item.read())
-    _path = f"/{path}/{item_filename}"
-    i = tbl.insert({"ppt_id": ppt_id, "name": _path})
+        tmp = s.IMG_DIR / f".{uuid.uuid4().hex}.upload"
+        sha256 = await write_upload(item, tmp, max_bytes)
+        _path = blobs.get_name(sha256, blobs.get_ext(item.filename))
+        # the same photo may be uploaded or released at once, variants
+        # are made once and reused by the later rows
+        async with blobs.lock(_path):
+            blobs.put(tmp, _path)
+            if await aiodb.first(
+                "SELECT 1 FROM ppt_images WHERE ppt_id = ? AND name = ?",
+                (ppt_id, _path),
+            ):
+                return None  # the same photo is already added
+            i = await _insert_file(tbl, ppt_id, _path, sha256)
+            i["variants"] = await save_img_variants(i)
+        return i
+    return await _insert_file(tbl, ppt_id, _path, sha256)
+
+
+async def _insert_file(tbl, ppt_id: int, name: str, sha256: str) -> dict:
+    i = {"ppt_id": ppt_id, "name": name, "sha256": sha256}
+    i["id"] = await aiodb.execute(
+        f"INSERT INTO {tbl.name} (ppt_id, name, sha256) VALUES (?, ?, ?)",
+        (ppt_id, name, sha256),
+    )
     return i
 
 
-def get_or_create(field: str, name: str | None = None) -> int:
-    """Get or create item in db. Return item id"""
-    tbl = s.FK_TABLES.get(field)
-    srch = ["", name][bool(name)]
-    itm = tbl.rows_where(
-        "LOWER(name) = ?",
-        (srch.lower(),),
-        select="id",
-        limit="1",
+_shared_variants_qry = """
+SELECT variant, name, width, height FROM ppt_image_variants WHERE image_id = (
+    SELECT MIN(v.image_id) FROM ppt_image_variants AS v
+    JOIN ppt_images AS pi ON pi.id = v.image_id
+    WHERE pi.name = ?
+)
+"""
+_variant_cols = ("image_id", "variant", "name", "width", "height")
+_upsert_variant_qry = f"""
+INSERT INTO ppt_image_variants ({", ".join(_variant_cols)}) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (image_id, variant) DO UPDATE SET
+name = excluded.name, width = excluded.width, height = excluded.height
+"""
+
+
+async def save_img_variants(img: dict) -> list[dict]:
+    """
+    Store variants of the ppt_images row photo. Variants of the blob made
+    for another row are reused, otherwise they are made.
+    """
+    shared = await aiodb.q(_shared_variants_qry, [img["name"]])
+    if shared:
+        variants = [{"image_id": img["id"], **v} for v in shared]
+    else:
+        variants = [
+            {
+                "image_id": img["id"],
+                "variant": v["variant"],
+                "name": f"/imgs/{v['path'].relative_to(s.IMG_DIR).as_posix()}",
+                "width": v["width"],
+                "height": v["height"],
+            }
+            for v in await images.make_variants(s.BASE_DIR / img["name"][1:])
+        ]
+    await aiodb.transaction(
+        *((_upsert_variant_qry, [v[k] for k in _variant_cols]) for v in variants)
     )
-    itm = list(itm)
-    if itm:
-        return itm[0]["id"]
+    return variants
+
 
-    itm = tbl.insert(name=name)
-    return itm["id"]
+_img_style = "width: 100%; height: 200px; object-fit: cover;"
 
 
-async def delete_pdf(fpath: str):
-    await aiofiles.os.remove(fpath)
+def _card_srcset(variants: list) -> tuple:
+    card = next((v for v in variants if v["variant"] == "card"), variants[0])
+    # small photos have several variants in the same file
+    srcset = {v["name"]: f'{v["name"]} {v["width"]}w' for v in variants}
+    return card, ", ".join(srcset.values())
+
+
+def ppt_img(item: dict, sizes: str = "33vw", **kwargs):
+    """
+    Photo with srcset of its variants, card variant is the fallback src.
+    Photos uploaded before variants existed are shown as is.
+    """
+    variants = item.get("variants")
+    if not variants:
+        return fh.Img(src=item["name"], loading="lazy", **kwargs)
+    card, srcset = _card_srcset(variants)
+    return fh.Img(
+        src=card["name"],
+        srcset=srcset,
+        sizes=sizes,
+        width=card["width"],
+        height=card["height"],
+        loading="lazy",
+        **kwargs,
+    )
+
+
+_imgs_qry = """
+SELECT pi.id, pi.name, v.variant, v.name AS v_name, v.width, v.height
+FROM ({images}) AS pi
+LEFT JOIN ppt_image_variants AS v ON v.image_id = pi.id
+ORDER BY pi.id, v.width
+"""
+
+
+def _group_variants(rows: list) -> list[dict]:
+    """Rows of _imgs_qry as images with a list of variants."""
+    imgs = {}
+    for r in rows:
+        img = imgs.setdefault(
+            r["id"], {"id": r["id"], "name": r["name"], "variants": []}
+        )
+        if r["variant"]:
+            img["variants"].append(
+                {
+                    "variant": r["variant"],
+                    "name": r["v_name"],
+                    "width": r["width"],
+                    "height": r["height"],
+                }
+            )
+    return list(imgs.values())
 
 
 def get_tbl_flds_for(ppt_type: int, ad_type: int | None, *args) -> list:
@@ -94,21 +221,29 @@ async def get_renamed_flds_for(
     return d
 
 
-def delete_file(path: str, id: int):
-    t = s.FILE_TABLES[path]
-    item = t[id]
+async def delete_file(path: str, id: int):
+    tbl = s.FILE_TABLES[path].name
+    item = await aiodb.first(f"SELECT name FROM {tbl} WHERE id = ?", (id,))
+    delete = (f"DELETE FROM {tbl} WHERE id = ?", (id,))
+    if path == "imgs":
+        # the photo can be shared with other rows
+        async with blobs.lock(item["name"]):
+            qry = "SELECT name FROM ppt_image_variants WHERE image_id = ?"
+            variants = [v["name"] for v in await aiodb.q(qry, (id,))]
+            await aiodb.execute(*delete)
+            await blobs.release(item["name"], variants)
+        return
     link = s.BASE_DIR / item["name"][1:]
     link.unlink()
-    t.delete(id)
+    await aiodb.execute(*delete)
 
 
 async def save_task_params(d: dict) -> None:
     for k, tbl in s.TSK_MULT_FK.items():
         if d.get(k):
             items = d[k] if isinstance(d.get(k), list) else [d[k]]
-            for itm in items:
-                if itm:
-                    tbl.insert({"task_id": d["task_id"], k: get_or_create(k, itm)})
+            ids = lookups.get_or_create_many(k, [itm for itm in items if itm])
+            tbl.insert_all({"task_id": d["task_id"], k: i} for i in ids)
     ppt_type = int(d["ppt_type"])
     tbl = s.PPT_TSK_TABLES[ppt_type]
     for m in ("min", "max"):
@@ -182,90 +317,6 @@ def slct_fld(nm: str, cs: dict, multiple: bool = False, **kwargs) -> fh.Select:
     )
 
 
-def range_script(prefix: str):
-    return f"""
-function updateSliderValues(prefix) {{
-    console.log("updateSliderValues is triggered for: " + prefix)
-    var minHandler = document.getElementById(prefix + "_min_handler");
-    var maxHandler = document.getElementById(prefix + "_max_handler");
-    var minInput = document.getElementById(prefix + "_min");
-    var maxInput = document.getElementById(prefix + "_max");
-    var range = document.getElementById(prefix + "_selected");
-
-    var minValue = parseInt(minHandler.value);
-    var maxValue = parseInt(maxHandler.value);
-
-    // Determine which slider is further left and which is further right
-    if (minValue > maxValue) {{
-        [minValue, maxValue] = [maxValue, minValue];  // Swap the values if needed
-    }}
-
-    // Update the input fields with slider values
-    minInput.value = minValue;
-    maxInput.value = maxValue;
-
-    // Update the slider track background to color the range in blue
-    fillrange(minHandler, maxHandler, range);
-}}
-
-function updateInputFields(prefix) {{
-    var minHandler = document.getElementById(prefix + "_min_handler");
-    var maxHandler = document.getElementById(prefix + "_max_handler");
-    var minInput = document.getElementById(prefix + "_min");
-    var maxInput = document.getElementById(prefix + "_max");
-    var range = document.getElementById(prefix + "_selected");
-
-    var minValue = parseInt(minInput.value);
-    var maxValue = parseInt(maxInput.value);
-
-    // Prevent the minimum input from exceeding the maximum input
-    if (minValue > maxValue) {{
-        minValue = 0;  // Swap the values if needed
-    }}
-
-    // Update the sliders with input values
-    minHandler.value = minValue;
-    maxHandler.value = maxValue;
-
-    // Trigger the slider value update logic
-    updateSliderValues(prefix);
-}}
-
-// Color the track between the two slider handles
-function fillrange(minHandler, maxHandler, range) {{
-    var rangeMin = parseInt(minHandler.min);
-    var rangeMax = parseInt(maxHandler.max);
-    var minValue = Math.min(minHandler.value, maxHandler.value);
-    var maxValue = Math.max(minHandler.value, maxHandler.value);
-
-    var leftPercentage = ((minValue - rangeMin) / (rangeMax - rangeMin)) * 100 + "%";
-    var rightPercentage = ((rangeMax - maxValue) / (rangeMax - rangeMin)) * 100 + "%";
-
-    range.style.left = leftPercentage;
-    range.style.right = rightPercentage;
-    
-}}
-
-// Attach event listeners to the input fields for initial setup
-document.getElementById("{prefix}_min").addEventListener("change", function() {{ updateInputFields('{prefix}'); }});
-document.getElementById("{prefix}_max").addEventListener("change", function() {{ updateInputFields('{prefix}'); }});
-
-// Attach event listeners to the slider handles
-document.getElementById("{prefix}_min_handler").addEventListener("input", function() {{ updateSliderValues('{prefix}'); }});
-document.getElementById("{prefix}_max_handler").addEventListener("input", function() {{ updateSliderValues('{prefix}'); }});
-
-// Initialize the slider with the correct track fill
-window.addEventListener('load', function() {{
-    updateSliderValues('{prefix}');
-}});
-
-document.body.addEventListener('htmx:afterSettle', function() {{
-    console.log("HTMX swap completed for prefix:", '{prefix}');
-    updateSliderValues('{prefix}');  // Reinitialize slider after HTMX swap
-}});
-"""
-
-
 def range_container(field: str, minimum: int, maximum: int, step: int, rename: str):
     d = {"min": minimum, "max": maximum}
     return fh.Div(
@@ -309,111 +360,10 @@ def range_container(field: str, minimum: int, maximum: int, step: int, rename: s
             ),
             cls="range",
         ),
-        fh.Script(range_script(field)),
+        data_range=field,
     )
 
 
-def autocomplete_script(prefix: str, multiple: bool):
-    return f"""
-    // Use 'me' and 'any' from Surreal for streamlined DOM interaction
-
-    // Show dropdown and filter options when typing
-    me("#{prefix}").on("input", ev => {{
-        let filter = me(ev).value.toLowerCase();
-        let options = any("#{prefix}_dropdown li");
-
-        options.forEach(option => {{
-            if (option.textContent.toLowerCase().includes(filter)) {{
-                option.style.display = "";  // Show matching option
-            }} else {{
-                option.style.display = "none";  // Hide non-matching option
-            }}
-        }});
-
-        me("#{prefix}_dropdown").style.display = "block";  // Show dropdown
-    }});
-
-    // Select an option from the dropdown
-    any("#{prefix}_dropdown li").on("click", ev => {{
-        let value = me(ev).textContent;
-        let prefix = "{prefix}";
-        
-        if ({'true' if multiple else 'false'}) {{            
-            addSelectedOption(value, prefix);  // Handle multiple selection
-            me("#" + prefix).value = "";  // Clear input after selection for multiple
-        }} else {{
-            me("#{prefix}").value = value;  // Handle single selection
-        }}
-
-        me("#{prefix}_dropdown").style.display = "none";  // Hide dropdown after selection
-    }});
-
-    // Add custom option on Enter key press for multiple selections
-    me("#{prefix}").on("keydown", ev => {{
-        if (ev.key === "Enter") {{
-            ev.preventDefault();  // Prevent form submission
-            let value = me("#{prefix}").value.trim();
-            let prefix = "{prefix}";
-            if (value) {{
-                if ({'true' if multiple else 'false'}) {{
-                    addSelectedOption(value, prefix);  // Add custom option for multiple
-                    me("#{prefix}").value = "";  // Clear input after Enter for multiple
-                }} else {{
-                    me("#{prefix}").value = value;  // For single selection, put the value in the input
-                }}
-                me("#{prefix}_dropdown").style.display = "none";  // Hide dropdown
-            }}
-        }}
-    }});
-
-    // Close the dropdown when clicking outside the input or dropdown
-    document.addEventListener("click", function(event) {{
-        let input = me("#{prefix}");
-        let dropdown = me("#{prefix}_dropdown");
-
-        // Close dropdown if the click is outside the input or dropdown
-        if (!input.contains(event.target) && !dropdown.contains(event.target)) {{
-            dropdown.style.display = "none";
-        }}
-    }});
-
-    // Function to add a selected option below the input and add a hidden input
-    function addSelectedOption(value, prefix) {{
-        let selected = "#" + prefix + "_selected";
-        let hidden = "#" + prefix + "_hidden";
-        let selected_span = "#" + prefix + "_selected span";
-        
-        let selectedContainer = me(selected);
-        let hiddenContainer = me(hidden);
-        let existingOptions = any(selected_span).map(option => option.textContent.trim());
-
-        if (!existingOptions.includes(value)) {{
-            let selectedItem = document.createElement("span");
-            selectedItem.className = "selected-item";
-            selectedItem.innerHTML = `${{value}} <button type="button" onclick="removeSelectedOption(this, '${{prefix}}', '${{value}}')">x</button>`;
-            selectedContainer.appendChild(selectedItem);
-
-            // Create a hidden input field to hold the value
-            let hiddenInput = document.createElement("input");
-            hiddenInput.type = "hidden";
-            hiddenInput.name = prefix;  // Treat as an array input
-            hiddenInput.value = value;
-            hiddenInput.id = prefix + "_hidden_" + value.replace(/\\s+/g, '_');  // Unique ID
-            hiddenContainer.appendChild(hiddenInput);
-        }}
-    }}
-
-    // Function to remove selected option and its corresponding hidden input
-    function removeSelectedOption(button, prefix, value) {{
-        me(button).parentElement.remove();  // Remove selected option from view
-        let hiddenInput = me("#" + prefix + "_hidden_" + value.replace(/\\s+/g, '_'));
-        if (hiddenInput) {{
-            hiddenInput.remove();  // Remove the hidden input
-        }}
-    }}
-    """
-
-
 def get_autocomplete_for(
     field: str,
     multiple: bool = False,
@@ -422,14 +372,18 @@ def get_autocomplete_for(
     prefil: list | None = None,
 ):
     """
-    Provide autocomplete field with options from db.table. For tables with name fld.
+    Provide autocomplete field with options from /autocomplete/{field}.
+    For tables with name fld.
     """
-    print(field)
     fld = fh.Input(
         id=field,
         type=tp,
         placeholder=const.RENAME_FLDS[field],
         autocomplete="off",  # Disable default browser autocomplete
+        hx_get=f"/autocomplete/{field}",
+        hx_trigger="input changed delay:300ms",
+        hx_target=f"#{field}_dropdown",
+        hx_sync="this:replace",
     )
     if labled:
         fld = fh.Label(
@@ -439,10 +393,6 @@ def get_autocomplete_for(
     return fh.Div(
         fld,
         fh.Ul(
-            *[
-                fh.Li(option["name"], value=option["id"], cls="dropdown-item")
-                for option in get_tbl_options(field)
-            ],  # Render the options dynamically with class
             id=f"{field}_dropdown",
             cls="dropdown-list",
             style="display:none;",  # Hide dropdown initially
@@ -455,9 +405,8 @@ def get_autocomplete_for(
         fh.Div(
             id=f"{field}_hidden"
         ),  # Container for hidden inputs (submitted with form)
-        fh.Script(
-            autocomplete_script(field, multiple)
-        ),  # Add the dynamic filtering and selection script
+        data_autocomplete=field,
+        data_multiple=multiple,  # js/autocomplete.js
     )
 
 
@@ -525,138 +474,37 @@ async def short_fltr(
     )
 
 
-def map_locations_script(d: list, query: str):
-    return f"""
-async function initMap() {{
-    const map = new google.maps.Map(document.getElementById("map"), {{
-        zoom: 4,
-        center: {{ lat: -23.533773, lng: -46.62529 }},
-        mapId: "DEMO_MAP_ID",
-    }});
-
-    const infoWindow = new google.maps.InfoWindow({{
-        content: "",
-    }});
-
-    const locations = {json.dumps(d)};  // 'd' is passed from Python as a list of locations
-    let markers = locations.map(poi => {{
-        const marker = new google.maps.Marker({{
-            position: poi.location,
-            map: map,
-            title: poi.name
-        }});
-
-        return marker;
-    }});
-
-    new markerClusterer.MarkerClusterer({{ markers, map }});
-
-    // Function to update the list of visible markers
-    function updateLocationList() {{
-        const bounds = map.getBounds();
-        const visibleLocations = locations.filter(poi => bounds.contains(new google.maps.LatLng(poi.location.lat, poi.location.lng)));
-        const locationList = document.getElementById("location-list");
-
-        locationList.innerHTML = visibleLocations.map(poi => `
-            <article class="card">
-                <div class="carousel" id="carousel-${{poi.id}}">
-                    ${{poi.images.map((img, index) => `
-                        <div class="carousel-item ${{index === 0 ? 'active' : ''}}">
-                            <img src="${{img}}" alt="Image ${{index + 1}}">
-                        </div>
-                    `).join('')}}
-                    <button class="carousel-control left" onclick="prevSlide('${{poi.id}}')">&#10094;</button>
-                    <button class="carousel-control right" onclick="nextSlide('${{poi.id}}')">&#10095;</button>
-                </div>
-                <a href='/ppts/${{poi.id}}{query}' style="text-decoration: none; color: inherit;" target="blank">
-                    <div class="content">
-                        <h5>${{poi.ppt_type}}: ${{poi.name}}</h5>
-                        <h6>Preço a partir de: ${{poi.price}} R$/m2</h6>
-                        <p>Area disponivel: ${{poi.min_area}} - ${{poi.max_area}} m2</p>
-                        <p>${{poi.street}}, ${{poi.city}}</p>
-                    </div>
-                </a>
-            </article>
-        `).join("");
-    }}
-
-    // Add listeners for zoom or drag events to update the list
-    map.addListener("bounds_changed", updateLocationList);
-    map.addListener("zoom_changed", updateLocationList);
-
-    // Initial update for the location list after map tiles have loaded
-    google.maps.event.addListenerOnce(map, 'tilesloaded', updateLocationList);
-}}
-
-document.body.addEventListener("htmx:afterSettle", function(evt) {{
-    if (document.querySelector("#map")) {{
-        initMap();  
-    }}
-}}, {{ passive: true }});
-
-// Carousel functions
-function nextSlide(id) {{
-    const carousel = document.querySelector(`#carousel-${{id}}`);
-    const items = carousel.querySelectorAll('.carousel-item');
-    let currentIndex = Array.from(items).findIndex(item => item.classList.contains('active'));
-
-    items[currentIndex].classList.remove('active');
-    const nextIndex = (currentIndex + 1) % items.length;
-    items[nextIndex].classList.add('active');
-}}
-
-function prevSlide(id) {{
-    const carousel = document.querySelector(`#carousel-${{id}}`);
-    const items = carousel.querySelectorAll('.carousel-item');
-    let currentIndex = Array.from(items).findIndex(item => item.classList.contains('active'));
-
-    items[currentIndex].classList.remove('active');
-    const prevIndex = (currentIndex - 1 + items.length) % items.length;
-    items[prevIndex].classList.add('active');
-}}
-"""
-
-
-def map_comparisons_script(d: list):
-    return f"""
-async function initMap() {{
-    const map = new google.maps.Map(document.getElementById("comparisons-map"), {{
-        zoom: 4,
-        center: {{ lat: -23.533773, lng: -46.62529 }},
-        mapId: "DEMO_MAP_ID",
-    }});
-
-    const infoWindow = new google.maps.InfoWindow({{
-        content: "",
-    }});
-
-    const locations = {json.dumps(d)};  // 'd' is passed from Python as a list of locations
-    let markers = locations.map(poi => {{
-        const marker = new google.maps.Marker({{
-            position: poi.location,
-            map: map,
-            title: poi.name
-        }});
-        return marker;
-    }});
-    new markerClusterer.MarkerClusterer({{ markers, map }});
-}}
-
-// Directly call initMap on window load
-window.addEventListener("load", function () {{
-    initMap();
-}});
-"""
-
-
-def ppt_serializer(ppt) -> dict:
-    ppt["location"] = json.loads(ppt.get("location"))
-    ppt["images"] = ppt.get("images").split(",") if ppt.get("images") else s.DEFAULT_IMG
+def ppt_serializer(ppt, srcsets: dict | None = None) -> dict:
+    """
+    Serialize ppt_search row for map script. srcsets maps image names
+    to (src, srcset) of their variants, see get_srcsets.
+    """
+    srcsets = srcsets or {}
+    lat, lng = ppt.pop("lat"), ppt.pop("lng")
+    # not geocoded yet
+    ppt["location"] = {"lat": lat, "lng": lng} if lat is not None else None
+    names = ppt["images"].split(",") if ppt.get("images") else [s.DEFAULT_IMG]
+    ppt["images"] = [
+        dict(zip(("src", "srcset"), srcsets.get(name, (name, "")))) for name in names
+    ]
     ppt_type = int(ppt["ppt_type"])
     ppt["ppt_type"] = const.PPT_TYPE[ppt_type]
     return ppt
 
 
+async def get_srcsets(ppt_ids: list) -> dict:
+    """(src, srcset) of the card variant by image name for properties."""
+    placeholders = ", ".join("?" for _ in ppt_ids)
+    imgs = f"SELECT id, name FROM ppt_images WHERE ppt_id IN ({placeholders})"
+    rows = await aiodb.q(_imgs_qry.format(images=imgs), ppt_ids)
+    srcsets = {}
+    for img in _group_variants(rows):
+        if img["variants"]:
+            card, srcset = _card_srcset(img["variants"])
+            srcsets[img["name"]] = (card["name"], srcset)
+    return srcsets
+
+
 def arrow(d):
     return fh.Button(
         fh.Img(src=f"/assets/icons/arrow-{d}.svg", alt="Arrow left"),
@@ -847,11 +695,31 @@ def get_tbl_options(fld_name: str):
         return tbl.rows_where(
             "role = ?",
             (role,),
-            select='name || " - " || email || " - " || id AS name, id',
+            select="name || ' - ' || email || ' - ' || id AS name, id",
         )
     return tbl.rows
 
 
+def get_autocomplete_qry(field: str, q: str) -> tuple:
+    """Prefix search on the normalized name of the field table."""
+    q = s.normalize_name(q) or ""
+    # every name starting with q sorts between q and q + max code point
+    where = "name_norm >= ? AND name_norm < ?"
+    params = [q, q + "\U0010ffff"]
+    select = "name, id"
+    if field in const.ROLE_FLDS:
+        select = "name || ' - ' || email || ' - ' || id AS name, id"
+        where = f"role = ? AND {where}"
+        params.insert(0, const.ROLE_FLDS[field])
+    qry = f"""
+    SELECT {select} FROM {s.FK_TABLES[field].name}
+    WHERE {where}
+    ORDER BY name_norm
+    LIMIT ?
+    """
+    return qry, (*params, const.AUTOCOMPLETE_LIMIT)
+
+
 def get_add_frm(
     parent_id: int, path: str, tp: str = "text", mlt: bool = False
 ) -> fh.Form:
@@ -883,7 +751,7 @@ def show_item(path: str, ppt_id: int, item: dict):
                     style="margin-bottom: -2px; margin-top: 0px;",
                 ),
             ),
-            fh.Embed(src=item["name"], type="image/jpeg", width="100%", height="200px"),
+            ppt_img(item, style=_img_style),
             id=f'{path}-{item["id"]}',
         )
     if path == "pdfs":
@@ -923,7 +791,7 @@ def get_layout_for(path: str, ppt_id: int, *args):
     )
 
 
-def get_block_for(path: str, ppt_id: int):
+async def get_block_for(path: str, ppt_id: int):
     if path == "infrs":
         i_qry = """
         SELECT i.*
@@ -931,10 +799,13 @@ def get_block_for(path: str, ppt_id: int):
         LEFT JOIN infrastructures as i ON p.infr_id = i.id
         WHERE p.ppt_id = ?
         """
-        qry = s.db.q(i_qry, (ppt_id,))
+        qry = await aiodb.q(i_qry, (ppt_id,))
+    elif path == "imgs":
+        imgs = "SELECT id, name FROM ppt_images WHERE ppt_id = ?"
+        qry = _group_variants(await aiodb.q(_imgs_qry.format(images=imgs), (ppt_id,)))
     else:
-        tbl = s.FILE_TABLES[path]
-        qry = tbl.rows_where("ppt_id = ?", (ppt_id,))
+        tbl = s.FILE_TABLES[path].name
+        qry = await aiodb.q(f"SELECT * FROM {tbl} WHERE ppt_id = ?", (ppt_id,))
     items = (show_item(path, ppt_id, i) for i in qry)
     return get_layout_for(path, ppt_id, *items)
 
@@ -983,7 +854,7 @@ def get_ad_ppt_type_flds() -> tuple:
                 for k, v in const.FILTER_FLDS["ad_type"].items()
             ],
             name="ad_type",
-            get="get_price_fld",
+            hx_get="/get_price_fld",
             hx_target="#price_type",
         ),
     ), fh.Label(
@@ -994,7 +865,7 @@ def get_ad_ppt_type_flds() -> tuple:
                 for k, v in const.FILTER_FLDS["ppt_type"].items()
             ],
             name="ppt_type",
-            get="get_ppts_fld",
+            hx_get="/get_ppts_fld",
             hx_target="#ppt_type",
         ),
     )
@@ -1034,15 +905,256 @@ async def get_fltr(
     )
 
 
-def extract_lat_lng(address: str) -> dict | None:
-    """Return lat lng of the address"""
-    # Geocoding an address
-    geocode_result = s.gmaps.geocode(address)
-    if geocode_result:
-        goecode = geocode_result[0]
-        lat_lng = goecode.get("geometry")["location"]
-        return lat_lng
-    return None
+def _fltr_values(d: dict, k: str) -> list:
+    """Non empty values of single or multiple choice filter field."""
+    items = d.get(k) if isinstance(d.get(k), list) else [d.get(k)]
+    return [str(i).strip() for i in items if i and str(i).strip()]
+
+
+def _fltr_number(d: dict, k: str) -> float | None:
+    try:
+        return float(d[k])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _fltr_choice(d: dict, k: str) -> int | None:
+    v = d.get(k)
+    if v in ("on", "true", "True"):
+        return s.Choice.YES
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_fltr_conditions(d: dict, ppt_type: int, ad_type: int) -> tuple:
+    """
+    Translate filter params into parameterized predicates.
+    Return (ppt_where, ppt_params, unit_where, unit_params).
+    Property predicates use alias ps (ppt_search),
+    unit predicates use alias m (unit table).
+    """
+    ppt_where, ppt_params = [], []
+    unit_where, unit_params = [], []
+    # multiple choice flds are passed by name
+    for k in const.FLTR_MULT_CHOICE_FLDS:
+        names = _fltr_values(d, k)
+        if not names:
+            continue
+        # unknown names match nothing, IN () is false
+        item_ids = lookups.get_ids(k, names)
+        ids = ", ".join("?" for _ in item_ids)
+        if k == "infr_id":
+            ppt_where.append(
+                f"ps.ppt_id IN (SELECT ppt_id FROM ppt_infrastructures WHERE infr_id IN ({ids}))"
+            )
+        else:
+            ppt_where.append(f"ps.{k} IN ({ids})")
+        ppt_params += item_ids
+    # choice flds
+    unit_bool_flds = s.WH_BOOL_FLDS if ppt_type == s.PropertyType.WAREHOUSE else tuple()
+    # under_construction is in both lists, filtered on ppt_search once
+    for k in dict.fromkeys((*s.PPT_CHOICE_FLDS, *unit_bool_flds)):
+        choice = _fltr_choice(d, k)
+        if choice not in (s.Choice.YES, s.Choice.NO):
+            continue
+        if k in s.PPT_CHOICE_FLDS:
+            ppt_where.append(f"ps.{k} = ?")
+            ppt_params.append(int(choice == s.Choice.YES))
+        else:
+            unit_where.append(f"m.{k} = ?")
+            unit_params.append(int(choice == s.Choice.YES))
+    # range flds. Slider bounds mean that the range is not limited.
+    ad_fld = const.AD_TYPE_FLDS[ad_type]
+    range_flds = (k[:-4] for k in s.PPT_TSK_PARAMS[ppt_type] if k.endswith("_min"))
+    for k in range_flds:
+        fld = ad_fld if k == "price" else k
+        for m, op in (("min", ">="), ("max", "<=")):
+            v = _fltr_number(d, f"{ad_fld}_{m}" if k == "price" else f"{k}_{m}")
+            if v is None and k == "price":
+                v = _fltr_number(d, f"price_{m}")
+            bound = const.RANGES[fld][const.MIN_MAX[m]]
+            if v is None or (m == "min" and v <= bound) or (m == "max" and v >= bound):
+                continue
+            unit_where.append(f"m.{fld} {op} ?")
+            unit_params.append(v)
+    return ppt_where, ppt_params, unit_where, unit_params
+
+
+def _rtree_box(south: float, west: float, north: float, east: float) -> tuple:
+    """Select address ids inside the box using addresses_rtree."""
+    # box may cross the antimeridian
+    lngs = [(west, east)] if west <= east else [(west, 180), (-180, east)]
+    qry = " UNION ALL ".join(
+        "SELECT id FROM addresses_rtree "
+        "WHERE max_lat >= ? AND min_lat <= ? AND max_lng >= ? AND min_lng <= ?"
+        for _ in lngs
+    )
+    return qry, [p for w, e in lngs for p in (south, north, w, e)]
+
+
+def get_ppts_qry(
+    d: dict,
+    ppt_type: int,
+    ad_type: int,
+    bounds: tuple | None = None,
+    cursor: int | None = None,
+    limit: int | None = None,
+    near: tuple | None = None,
+) -> tuple:
+    """
+    Query for properties map. Read ppt_search and check unit params
+    only for the properties that match property params.
+    bounds are (south, west, north, east), near is (lat, lng, radius_km),
+    cursor is the last ppt_id of the previous page.
+    """
+    ranges, params = _ppt_ranges(d, ppt_type, ad_type)
+    where, where_params = _ppts_where(d, ppt_type, ad_type, bounds, near)
+    params += where_params
+    if cursor:
+        where.append("ps.ppt_id > ?")
+        params.append(cursor)
+    qry = f"""
+    SELECT ps.ppt_id AS id, ps.lat, ps.lng, ps.ppt_type, ps.name,
+    ps.city, ps.street, ps.images, {ranges}
+    FROM ppt_search AS ps
+    WHERE {" AND ".join(where)}
+    ORDER BY ps.ppt_id
+    """
+    if limit:
+        qry += "LIMIT ?"
+        params.append(limit)
+    return qry, tuple(params)
+
+
+def _units_match(ppt_type: int, unit_where: list, unit_params: list) -> tuple:
+    """FROM clause of active units of the ppt_search row matching unit_where."""
+    unit_tbl = s.PPT_TABLE_NAMES[ppt_type]
+    qry = f"""FROM {unit_tbl} AS m
+    WHERE m.ppt_id = ps.ppt_id AND m.status = ? AND {" AND ".join(unit_where)}"""
+    return qry, [s.Status.ACTIVE, *unit_params]
+
+
+def _ppt_ranges(d: dict, ppt_type: int, ad_type: int) -> tuple:
+    """
+    min_area, max_area and price columns of ppt_search rows. With unit
+    params they are aggregated over the matching units only, so cards
+    do not show ranges of the units excluded by the filter.
+    """
+    *_, unit_where, unit_params = get_fltr_conditions(d, ppt_type, ad_type)
+    if not unit_where:
+        return "ps.min_area, ps.max_area, ps.price", []
+    units, params = _units_match(ppt_type, unit_where, unit_params)
+    aggs = {
+        "min_area": "MIN(m.area)",
+        "max_area": "SUM(m.area)",  # as in ppt_search, the total area
+        "price": f"MIN(m.{const.AD_TYPE_FLDS[ad_type]})",
+    }
+    cols = ", ".join(f"(SELECT {agg} {units}) AS {k}" for k, agg in aggs.items())
+    return cols, params * len(aggs)
+
+
+def _ppts_where(
+    d: dict,
+    ppt_type: int,
+    ad_type: int,
+    bounds: tuple | None = None,
+    near: tuple | None = None,
+) -> tuple:
+    """Predicates and params over ppt_search for get_ppts_qry."""
+    ppt_where, ppt_params, unit_where, unit_params = get_fltr_conditions(
+        d, ppt_type, ad_type
+    )
+    where = ["ps.ppt_type = ?", "ps.ad_type = ?", *ppt_where]
+    params = [ppt_type, ad_type, *ppt_params]
+    if bounds:
+        box, box_params = _rtree_box(*bounds)
+        where.append(f"ps.adrs_id IN ({box})")
+        params += box_params
+    if near:
+        lat, lng, km = near
+        dlat = km / const.KM_PER_DEG
+        dlng = km / (const.KM_PER_DEG * max(math.cos(math.radians(lat)), 0.01))
+        box, box_params = _rtree_box(lat - dlat, lng - dlng, lat + dlat, lng + dlng)
+        where.append(f"ps.adrs_id IN ({box})")
+        params += box_params
+        # equirectangular distance is precise enough for the city scale
+        where.append(
+            "(ps.lat - ?) * (ps.lat - ?) + (ps.lng - ?) * (ps.lng - ?) * ? <= ?"
+        )
+        cos2 = math.cos(math.radians(lat)) ** 2
+        params += [lat, lat, lng, lng, cos2, dlat * dlat]
+    if unit_where:
+        units, units_params = _units_match(ppt_type, unit_where, unit_params)
+        where.append(f"EXISTS (SELECT 1 {units})")
+        params += units_params
+    return where, params
+
+
+# grid cell of the point at zoom level z, see mysettings._create_ppt_clusters
+_CELL_X = "CAST(({lng} + 180) / z.cell AS INTEGER)"
+_CELL_Y = "CAST(({lat} + 90) / z.cell AS INTEGER)"
+
+
+def get_clusters_qry(
+    d: dict, ppt_type: int, ad_type: int, zoom: int, bounds: tuple
+) -> tuple:
+    """
+    Query for map clusters of the zoom level in the viewport. Precomputed
+    ppt_clusters are used without filter params, otherwise matching
+    ppt_search rows are grouped on the fly.
+    """
+    zoom = min(max(zoom, 0), s.CLUSTER_MAX_ZOOM)
+    if any(get_fltr_conditions(d, ppt_type, ad_type)):
+        ranges, ranges_params = _ppt_ranges(d, ppt_type, ad_type)
+        where, params = _ppts_where(d, ppt_type, ad_type, bounds)
+        qry = f"""
+        SELECT COUNT(*) AS n, AVG(r.lat) AS lat, AVG(r.lng) AS lng,
+        MIN(r.price) AS price
+        FROM (
+            SELECT ps.lat, ps.lng, {ranges}
+            FROM ppt_search AS ps
+            WHERE {" AND ".join(where)}
+        ) AS r, cluster_zooms AS z
+        WHERE z.zoom = ?
+        GROUP BY {_CELL_X.format(lng="r.lng")}, {_CELL_Y.format(lat="r.lat")}
+        """
+        return qry, (*ranges_params, *params, zoom)
+    south, west, north, east = bounds
+    cx = "c.cx BETWEEN {w} AND {e}" if west <= east else "(c.cx >= {w} OR c.cx <= {e})"
+    cx = cx.format(w=_CELL_X.format(lng="?"), e=_CELL_X.format(lng="?"))
+    qry = f"""
+    SELECT c.n, c.lat_sum / c.n AS lat, c.lng_sum / c.n AS lng,
+    c.min_price AS price
+    FROM ppt_clusters AS c
+    JOIN cluster_zooms AS z ON c.zoom = z.zoom
+    WHERE c.ppt_type = ? AND c.ad_type = ? AND c.zoom = ? AND {cx}
+    AND c.cy BETWEEN {_CELL_Y.format(lat="?")} AND {_CELL_Y.format(lat="?")}
+    """
+    return qry, (ppt_type, ad_type, zoom, west, east, south, north)
+
+
+def get_cmp_clusters_qry(user_id: int, ppt_type: int, ad_type: int, zoom: int) -> tuple:
+    """Query for map clusters of the user comparisons."""
+    zoom = min(max(zoom, 0), s.CLUSTER_MAX_ZOOM)
+    qry = f"""
+    SELECT COUNT(*) AS n, AVG(a.lat) AS lat, AVG(a.lng) AS lng, NULL AS price
+    FROM comparisons AS cmp
+    JOIN properties AS p ON cmp.ppt_id = p.id
+    JOIN addresses AS a ON p.adrs_id = a.id
+    JOIN cluster_zooms AS z ON z.zoom = ?
+    WHERE cmp.user_id = ? AND cmp.ad_type = ? AND NOT cmp.status = ?
+    AND p.ppt_type = ? AND a.lat IS NOT NULL
+    GROUP BY {_CELL_X.format(lng="a.lng")}, {_CELL_Y.format(lat="a.lat")}
+    """
+    return qry, (zoom, user_id, ad_type, s.Status.ARCHIVE, ppt_type)
+
+
+def get_query_dict(req) -> dict:
+    """Query params of the request. Repeated params are returned as list."""
+    qp = req.query_params
+    return {k: v if len(v := qp.getlist(k)) > 1 else v[0] for k in qp}
 
 
 def broker_hide_or_slct_fld(sess: dict):
@@ -1072,8 +1184,8 @@ def user_add_or_slct_fld(fld: str, **kwargs):
 
 
 async def get_ppt_units(ppt_id: int, flds: list, ad_type: int | None = None):
-    ppt = s.properties[ppt_id]
-    ppt_type = ppt.ppt_type
+    ppt = await aiodb.first("SELECT ppt_type FROM properties WHERE id = ?", (ppt_id,))
+    ppt_type = ppt["ppt_type"]
     unit = s.PPT_TABLE_NAMES.get(ppt_type)
     slct = """
     (rent * area) as rent,
@@ -1104,12 +1216,15 @@ async def get_ppt_units(ppt_id: int, flds: list, ad_type: int | None = None):
     WHERE p.id = ?
     """
 
-    db_q = s.db.q(qry, (ppt_id,))
+    db_q = await aiodb.q(qry, (ppt_id,))
     ppt = db_q[0]
 
     return ppt, await get_units_tbl(db_q, ppt_type, ad_type, *flds)
 
 
+_yes_no = {1: "Sim", 0: "Não"}
+
+
 def get_min_max_modified(fld: str):
     min_fld = f"min_{fld}"
     max_fld = f"max_{fld}"
@@ -1120,6 +1235,10 @@ def get_min_max_modified(fld: str):
     )
 
 
+def get_bool_modified(fld: str):
+    return lambda row: _yes_no.get(row[fld], row[fld])
+
+
 def get_modification_dict(for_comparison: bool = False) -> dict:
     md_dict = {
         "edit": lambda row: f"<a hx-get='/ppts/{row['ppt_id']}/units/{row['id']}/edit_frm' hx-target='#dialog' hx-swap='innerHTML'>Editar</a>",
@@ -1132,25 +1251,44 @@ def get_modification_dict(for_comparison: bool = False) -> dict:
     return md_dict
 
 
-async def get_units_tbl(
-    db_q, ppt_type: int, ad_type: int | None, *flds, for_comparison: bool = False
-):
-    df = pd.DataFrame(db_q)
-    bool_flds = bool_flds = (
-        list(s.WH_BOOL_FLDS)
+# (label, formatter) of get_units_tbl fields by its arguments
+_units_tbl_flds: dict[tuple, list] = {}
+
+
+async def get_units_tbl_flds(
+    ppt_type: int, ad_type: int | None, flds: tuple, for_comparison: bool = False
+) -> list[tuple]:
+    """Labels and formatters of the units table fields, made once per args."""
+    key = (ppt_type, ad_type, flds, for_comparison)
+    if key in _units_tbl_flds:
+        return _units_tbl_flds[key]
+    bool_flds = (
+        s.WH_BOOL_FLDS
         if ppt_type == s.PropertyType.WAREHOUSE
         else ["under_construction"]
     )
-    df[bool_flds] = df[bool_flds].replace({1: "Sim", 0: "Não"})
-    flds_list = get_tbl_flds_for(ppt_type, ad_type, *flds)
     modification_dict = get_modification_dict(for_comparison)
-    for k in flds_list:
-        if modification_dict.get(k):
-            df[k] = df.apply(modification_dict[k], axis=1)
     rename_dict = await get_renamed_flds_for(ppt_type, price_per_month=True)
-    tbl = df[flds_list].rename(columns=rename_dict)
-    tbl = tbl.transpose()
-    return tbl
+    tbl_flds = []
+    for k in get_tbl_flds_for(ppt_type, ad_type, *flds):
+        if k in modification_dict:
+            fmt = modification_dict[k]
+        elif k in bool_flds:
+            fmt = get_bool_modified(k)
+        else:
+            fmt = operator.itemgetter(k)
+        tbl_flds.append((rename_dict.get(k, k), fmt))
+    _units_tbl_flds[key] = tbl_flds
+    return tbl_flds
+
+
+async def get_units_tbl(
+    db_q, ppt_type: int, ad_type: int | None, *flds, for_comparison: bool = False
+) -> UnitsTable:
+    if not db_q:
+        raise ValueError("No units")
+    tbl_flds = await get_units_tbl_flds(ppt_type, ad_type, flds, for_comparison)
+    return UnitsTable.build(db_q, tbl_flds)
 
 
 async def get_infr(ppt_id: int):
@@ -1160,7 +1298,7 @@ async def get_infr(ppt_id: int):
     LEFT JOIN infrastructures as i ON pi.infr_id = i.id
     WHERE ppt_id = ?
     """
-    db_q = s.db.q(qry, (ppt_id,))
+    db_q = await aiodb.q(qry, (ppt_id,))
     return fh.Label(
         fh.H2("Infraestrutura:"),
         fh.Grid(
@@ -1170,27 +1308,71 @@ async def get_infr(ppt_id: int):
     )
 
 
-async def get_embeded_imgs(ppt_id: int, **kwargs):
-    return (
-        fh.Embed(src=i["name"], type="image/jpeg", width="100%", height="200px")
-        for i in s.ppt_images.rows_where("ppt_id = ?", (ppt_id,), **kwargs)
-    )
+async def get_embeded_imgs(ppt_id: int, limit: int = -1):
+    imgs = "SELECT id, name FROM ppt_images WHERE ppt_id = ? ORDER BY id LIMIT ?"
+    rows = await aiodb.q(_imgs_qry.format(images=imgs), (ppt_id, limit))
+    return (ppt_img(i, style=_img_style) for i in _group_variants(rows))
 
 
 async def get_imgs(ppt_id):
-    n = s.ppt_images.count_where("ppt_id = ?", (ppt_id,))
+    cnt, imgs = await asyncio.gather(
+        aiodb.first("SELECT COUNT(*) AS n FROM ppt_images WHERE ppt_id = ?", (ppt_id,)),
+        get_embeded_imgs(ppt_id, limit=3),
+    )
+    n = cnt["n"]
     return fh.Div(
         fh.Grid(
-            *(await get_embeded_imgs(ppt_id, limit=3)),
+            *imgs,
             style="grid-template-columns: 1fr 1fr 1fr",
         ),
         fh.Button(f"Ver {n} fotos", hx_get=f"/{ppt_id}/imgs", hx_target="#dialog"),
     )
 
 
+# Rendered property views by (ppt_id, ad_type, tbl_flds, submit_btns),
+# the tbl_flds and buttons depend on the user role.
+_ppt_views = cache.FragmentCache(const.PPT_VIEW_CACHE_SIZE)
+# user_id input of the cached view, replaced for every request
+_user_id_inp = fh.to_xml(fh.Hidden(id="user_id", value="__user_id__"))
+
+
+async def get_ppt_version(ppt_id: int) -> int:
+    """ppt_versions version of the property, bumped on any edit."""
+    row = await aiodb.first(
+        "SELECT version FROM ppt_versions WHERE ppt_id = ?", (ppt_id,)
+    )
+    return row["version"] if row else 0
+
+
+async def get_ppt_version(ppt_id: int) -> int:
+    """ppt_versions version of the property, 0 if never edited."""
+    row = await aiodb.first(
+        "SELECT version FROM ppt_versions WHERE ppt_id = ?", (ppt_id,)
+    )
+    return row["version"] if row else 0
+
+
 async def get_ppt_infr_img_units(
     ppt_id: int, user_id: int, tbl_flds: list, *submit_btns, ad_type: int | None = None
 ):
+    key = (ppt_id, ad_type, tuple(tbl_flds), submit_btns)
+    # read before the data, so the view is never older than its version
+    version = await get_ppt_version(ppt_id)
+    view = _ppt_views.get(key, version)
+    if view is None:
+        view = await render_ppt_view(ppt_id, tbl_flds, submit_btns, ad_type)
+        _ppt_views.put(key, version, view)
+    title, html = view
+    user_id_inp = fh.to_xml(fh.Hidden(id="user_id", value=user_id))
+    return fh.Titled(
+        title, fh.NotStr(html.replace(_user_id_inp, user_id_inp, 1)), id="result"
+    )
+
+
+async def render_ppt_view(
+    ppt_id: int, tbl_flds: list, submit_btns: tuple, ad_type: int | None
+) -> tuple[str, str]:
+    """Title and html of the property view, without the user id."""
     (ppt, tbl), inf, img = await asyncio.gather(
         get_ppt_units(ppt_id, tbl_flds, ad_type),
         get_infr(ppt_id),
@@ -1214,32 +1396,35 @@ async def get_ppt_infr_img_units(
             btns["pdf_path"] = fh.A(
                 "Mostrar arquivo", href=f"/pdf?pdf_path={path}", **_blank
             )
-    return fh.Titled(
-        f'{const.PPT_TYPE.get(ppt["ppt_type"])} RET{ppt_id:03d}',
-        fh.Grid(
-            fh.P(f"{ppt['street']} - {ppt['city']}", id="address"),
-            btns.get("edit"),
-        ),
-        img,
-        fh.Label(fh.H2("Descricao:"), _for="description"),
-        fh.Div(ppt["description"], id="description"),
-        inf,
-        btns.get("pdf_path"),
-        fh.Label(fh.Grid(fh.H2("Unidades:"), btns.get("add_unit")), _for="#modules"),
-        fh.Form(
-            fh.Hidden(id="user_id", value=user_id),
-            fh.Hidden(id="ppt_id", value=ppt_id),
-            fh.Hidden(id="ppt_type", value=ppt["ppt_type"]),
-            fh.Hidden(id="ad_type", value=ad_type),
-            fh.NotStr(tbl.to_html(escape=False, header=False)),
-            id="modules",
-            cls="table-container",
-        ),
-        *btns.get("submit"),
-        fh.Div(id="dialog"),
-        fh.Div(id="register"),
-        id="result",
+    html = fh.to_xml(
+        (
+            fh.Grid(
+                fh.P(f"{ppt['street']} - {ppt['city']}", id="address"),
+                btns.get("edit"),
+            ),
+            img,
+            fh.Label(fh.H2("Descricao:"), _for="description"),
+            fh.Div(ppt["description"], id="description"),
+            inf,
+            btns.get("pdf_path"),
+            fh.Label(
+                fh.Grid(fh.H2("Unidades:"), btns.get("add_unit")), _for="#modules"
+            ),
+            fh.Form(
+                fh.NotStr(_user_id_inp),
+                fh.Hidden(id="ppt_id", value=ppt_id),
+                fh.Hidden(id="ppt_type", value=ppt["ppt_type"]),
+                fh.Hidden(id="ad_type", value=ad_type),
+                fh.NotStr(tbl.to_html()),
+                id="modules",
+                cls="table-container",
+            ),
+            *btns.get("submit"),
+            fh.Div(id="dialog"),
+            fh.Div(id="register"),
+        )
     )
+    return f'{const.PPT_TYPE.get(ppt["ppt_type"])} RET{ppt_id:03d}', html
 
 
 async def create_cmp(data: dict, unit_ids: list[str]):
@@ -1258,16 +1443,26 @@ async def create_cmp(data: dict, unit_ids: list[str]):
     return fh.A("Ver comparações", type="submit", href=f"/comparisons?{qry}", **_blank)
 
 
+def _cmp_where(data: dict) -> tuple:
+    """WHERE clause and params of the selected or all active user comparisons."""
+    if data.get("selected"):
+        placeholders = ", ".join(["?" for _ in data["selected"]])
+        return f"WHERE cmp.id IN ({placeholders})", tuple(data["selected"])
+    where_fld = "WHERE cmp.user_id = ? AND cmp.ad_type = ? AND NOT cmp.status = ? AND p.ppt_type = ?"
+    params = (
+        int(data["user_id"]),
+        int(data["ad_type"]),
+        s.Status.ARCHIVE,
+        int(data["ppt_type"]),
+    )
+    return where_fld, params
+
+
 async def get_cmp_for(data: dict, flds: tuple, return_frm: bool = False):
     ppt_type = int(data["ppt_type"])
     ad_type = int(data["ad_type"])
     user_id = int(data["user_id"])
-    where_fld = "WHERE cmp.user_id = ? AND cmp.ad_type = ? AND NOT cmp.status = ? AND p.ppt_type = ?"
-    params = (user_id, ad_type, s.Status.ARCHIVE, ppt_type)
-    if data.get("selected"):
-        placeholders = ", ".join(["?" for _ in data["selected"]])
-        where_fld = f"WHERE cmp.id IN ({placeholders})"
-        params = data["selected"]
+    where_fld, params = _cmp_where(data)
     table = s.PPT_TABLE_NAMES.get(ppt_type)
     cmp_table = s.PPT_CMP_TABLES.get(ppt_type)
     slct = (
@@ -1291,7 +1486,7 @@ async def get_cmp_for(data: dict, flds: tuple, return_frm: bool = False):
             + ", "
         )
     qry = f"""
-    SELECT cmp.id as id, p.name, p.ppt_type, d.name as district, c.name as city, a.location,
+    SELECT cmp.id as id, p.name, p.ppt_type, d.name as district, c.name as city, a.lat, a.lng,
     GROUP_CONCAT(m.title, ', ') as title,
     {slct}
     SUM(area) as area
@@ -1305,9 +1500,14 @@ async def get_cmp_for(data: dict, flds: tuple, return_frm: bool = False):
     {where_fld}
     GROUP BY cmp.id
     """
-    db_q = s.db.q(qry, params)
+    db_q = await aiodb.q(qry, params)
     locations = [
-        {"index": i + 1, "location": json.loads(d.get("location"))}
+        {
+            "index": i + 1,
+            "location": (
+                {"lat": d["lat"], "lng": d["lng"]} if d["lat"] is not None else None
+            ),
+        }
         for i, d in enumerate(db_q)
     ]
     tbl = await get_units_tbl(db_q, ppt_type, ad_type, *flds, for_comparison=True)
@@ -1316,7 +1516,7 @@ async def get_cmp_for(data: dict, flds: tuple, return_frm: bool = False):
             fh.Hidden(id="user_id", value=user_id),
             fh.Hidden(id="ad_type", value=ad_type),
             fh.Hidden(id="ppt_type", value=ppt_type),
-            fh.NotStr(tbl.to_html(escape=False, header=False)),
+            fh.NotStr(tbl.to_html()),
             fh.Button("Download site selection", id="download_btn"),
             action="/download_pdf",
             method="post",
@@ -1326,17 +1526,9 @@ async def get_cmp_for(data: dict, flds: tuple, return_frm: bool = False):
     return tbl, locations
 
 
-async def create_pdf(data: dict, output_pdf):
-    """Create pdf using reportlab."""
-    ppt_type = int(data["ppt_type"])
-    ad_type = int(data["ad_type"])
-    user_id = int(data["user_id"])
-    where_fld = "WHERE cmp.user_id = ? AND cmp.ad_type = ? AND NOT cmp.status = ? AND p.ppt_type = ?"
-    params = (user_id, ad_type, s.Status.ARCHIVE, ppt_type)
-    if data.get("selected"):
-        placeholders = ", ".join(["?" for _ in data["selected"]])
-        where_fld = f"WHERE cmp.id IN ({placeholders})"
-        params = data["selected"]
+async def get_pdf_data(data: dict) -> tuple:
+    """Comparisons table, locations and images for pdf_builder.render_pdf."""
+    where_fld, params = _cmp_where(data)
     flds = ("address", "name")
     tbl, locations = await get_cmp_for(data, flds)
     qry_img = f"""
@@ -1351,359 +1543,28 @@ async def create_pdf(data: dict, output_pdf):
     {where_fld}
     GROUP BY cmp.id
     """
-    db_imgs = s.db.q(qry_img, params)
-
-    # Register fonts
-    pdfmetrics.registerFont(TTFont("Poppins", "assets/fonts/Poppins-Regular.ttf"))
-
-    # Create a PPTF
-    pdf_canvas = canvas.Canvas(
-        output_pdf, pagesize=(const.PAGE_WIDTH, const.PAGE_HEIGHT), pageCompression=1
-    )
-    # First page
-    pdf_canvas.drawImage(
-        const.COVER_BGD, 0, 0, width=const.PAGE_WIDTH, height=const.PAGE_HEIGHT
-    )
-    pdf_canvas.setFont("Poppins", 60)
-    pdf_canvas.setFillColor(colors.white)
-    pdf_canvas.drawString(const.LR_PADDING, const.TOP_PADDING, "Opções para locação")
-    pdf_canvas.drawString(const.LR_PADDING, const.TOP_PADDING - 60, "Limeira e região")
-
-    # Bookmark the first page and add an outline entry
-    pdf_canvas.bookmarkPage("first_page")
-    pdf_canvas.addOutlineEntry("Cover", "first_page", level=0)
-
-    pdf_canvas.showPage()
-
-    # About page
-    pdf_canvas.drawImage(
-        const.ABOUT_BGD, 0, 0, width=const.PAGE_WIDTH, height=const.PAGE_HEIGHT
-    )
-
-    # Bookmark the about page and add an outline entry
-    pdf_canvas.bookmarkPage("about_page")
-    pdf_canvas.addOutlineEntry("About", "about_page", level=0)
-
-    pdf_canvas.showPage()
-
-    # Step 1: Define a form XObject for the background
-    pdf_canvas.beginForm("background_form")
-    pdf_canvas.drawImage(
-        const.BODY_BGD, 0, 0, width=const.PAGE_WIDTH, height=const.PAGE_HEIGHT
-    )
-    pdf_canvas.endForm()
-
-    # Second page (static map and links)
-    pdf_canvas.doForm("background_form")
-
-    # Insert static map
-    pdf_canvas.drawImage(const.static_map_image, 400, 200, width=1200, height=800)
-
-    locations_list = (
-        (
-            f"Imóvel_{i['index']:02d}",
-            f"https://www.google.com/maps?q={i['location']['lat']},{i['location']['lng']}",
-        )
-        for i in locations
-    )
-    # Add "See on map" links
-    y_position = 150
-    pdf_canvas.setFont("Poppins", 40)
-    pdf_canvas.drawString(400, y_position, "See on map:")
-    w = 250
-    for idx, (label, url) in enumerate(locations_list, start=1):
-        pdf_canvas.drawString(400 + idx * w, y_position, label)
-        pdf_canvas.linkURL(
-            url, (400 + idx * w, y_position, 400 + idx * w + w, y_position + 40)
-        )
-
-    # Bookmark the map page and add an outline entry
-    pdf_canvas.bookmarkPage("map_page")
-    pdf_canvas.addOutlineEntry("Map and Locations", "map_page", level=0)
-
-    pdf_canvas.showPage()
-
-    # Add Table Page (with 2.jpg background)
-    pdf_canvas.doForm("background_form")
-
-    # Create a ReportLab stylesheet for Paragraphs
-    styles = getSampleStyleSheet()
-
-    # Define a custom ParagraphStyle with increased font size
-    custom_style = ParagraphStyle(
-        name="Custom",
-        fontName="Poppins",  # Use Poppins font or your preferred font
-        fontSize=25,  # Set desired font size here
-        leading=28,  # Set line height (optional)
-        # alignment=1,  # Center align (optional)
-    )
-    # Convert the DataFrame headers and rows to Paragraphs
-    data = []
-    header_row = [Paragraph("Imóvel", custom_style)] + [
-        Paragraph(f"{i + 1:02d}", custom_style) for i in tbl.columns
-    ]
-    data.append(header_row)
-    # Convert each row in the DataFrame to Paragraphs
-    for index, row in tbl.iterrows():
-        row_data = [Paragraph(str(index), custom_style)] + [
-            Paragraph(str(cell), custom_style) for cell in row
-        ]
-        data.append(row_data)
-
-    # Dynamically calculate column widths based on page size and padding
-    available_width = const.PAGE_WIDTH - 2 * const.LR_PADDING
-    col_width = available_width / len(data[0])
-    tbl_width = [col_width] * len(data[0])
-
-    # Create a table with dynamically calculated column widths
-    table = Table(data, colWidths=tbl_width)
-
-    # Define table style with increased font size
-    table.setStyle(
-        TableStyle(
-            [
-                (
-                    "BACKGROUND",
-                    (0, 0),
-                    (-1, 1),
-                    colors.lightblue,
-                ),  # Header background color
-                ("TEXTCOLOR", (0, 0), (-1, 1), colors.whitesmoke),  # Header text color
-                ("ALIGN", (0, 0), (-1, -1), "CENTER"),
-                ("FONTNAME", (0, 0), (-1, -1), "Poppins"),
-                ("FONTSIZE", (0, 0), (-1, -1), 46),  # Increased font size
-                (
-                    "VALIGN",
-                    (0, 0),
-                    (-1, -1),
-                    "TOP",
-                ),  # Align text to the top of the cell
-                # ('BOTTOMPADDING', (0, 0), (-1, -1), 16),
-                ("BACKGROUND", (0, 2), (-1, -1), colors.beige),  # Body background color
-                ("GRID", (0, 0), (-1, -1), 1, colors.black),
-            ]
-        )
-    )
-
-    # Table height for calculating col positions (assumes uniform col heights)
-    first_col_y = (
-        const.PAGE_HEIGHT - const.TOP_PADDING
-    )  # Starting y-position for the first col
-    col_height = 40
-
-    # Add links manually for the first column cols
-    for col_idx in tbl.columns:
-        header_number = f"{col_idx + 1:02d}"
-
-        # Calculate the y position of each col's cell
-        col_x_position = const.LR_PADDING + (col_idx + 1) * col_width
-
-        # Define the clickable rectangle (adjust left/right as needed)
-        link_rect = (
-            col_x_position,
-            first_col_y,
-            col_x_position + col_width,
-            first_col_y - col_height,
-        )
-
-        # Add the clickable area linking to the bookmark
-        pdf_canvas.linkRect(header_number, header_number, link_rect)
-
-    # Wrap and draw the table
-    table_width, table_height = table.wrap(
-        const.PAGE_WIDTH, const.PAGE_HEIGHT - const.TOP_PADDING
-    )
-    table.drawOn(
-        pdf_canvas,
-        const.LR_PADDING,
-        const.PAGE_HEIGHT - const.TOP_PADDING - table_height,
-    )
-
-    # Bookmark the table page and add an outline entry
-    pdf_canvas.bookmarkPage("table_page")
-    pdf_canvas.addOutlineEntry("Table Overview", "table_page", level=0)
-
-    pdf_canvas.showPage()
-
-    # Add Dynamic Pages for each comparison
-    for idx in tbl.columns:
-        header_number = f"{idx + 1:02d}"
+    db_imgs = await aiodb.q(qry_img, params)
+    return tbl, locations, db_imgs
 
-        # Bookmark each row dynamically and add to the outline
-        pdf_canvas.bookmarkPage(header_number)
-        pdf_canvas.addOutlineEntry(
-            f"Details for Column {idx + 1}", header_number, level=1
-        )
-
-        # Create two pages for each row
-        pdf_canvas.doForm("background_form")
-        pdf_canvas.setFont("Poppins", 40)
-        pdf_canvas.drawString(
-            const.LR_PADDING,
-            const.PAGE_HEIGHT - const.TOP_PADDING + 100,
-            f"Imóvel {idx + 1:02d}",
-        )
-
-        column_data = (
-            tbl[idx].reset_index().values.tolist()
-        )  # Converts the column into a list of [index, value] pairs
-        table1 = Table(column_data[:-5], colWidths=[350] * 2)
-        # Define table style with increased font size
-        table1.setStyle(
-            TableStyle(
-                [
-                    (
-                        "BACKGROUND",
-                        (0, 0),
-                        (0, -1),
-                        colors.lightblue,
-                    ),  # Header background color
-                    (
-                        "TEXTCOLOR",
-                        (0, 0),
-                        (0, -1),
-                        colors.whitesmoke,
-                    ),  # Header text color
-                    ("ALIGN", (0, 0), (-1, -1), "LEFT"),
-                    ("FONTNAME", (0, 0), (-1, -1), "Poppins"),
-                    ("FONTSIZE", (0, 0), (-1, -1), 26),  # Increased font size
-                    (
-                        "VALIGN",
-                        (0, 0),
-                        (-1, -1),
-                        "TOP",
-                    ),  # Align text to the top of the cell
-                    ("BOTTOMPADDING", (0, 0), (-1, -1), 30),
-                    (
-                        "BACKGROUND",
-                        (1, 0),
-                        (1, -1),
-                        colors.beige,
-                    ),  # Body background color
-                    ("GRID", (0, 0), (-1, -1), 1, colors.black),
-                ]
-            )
-        )
-        # Wrap and draw the table
-        table1_width, table1_height = table1.wrap(
-            const.PAGE_WIDTH, const.PAGE_HEIGHT - const.TOP_PADDING
-        )
-        table1.drawOn(
-            pdf_canvas,
-            const.LR_PADDING,
-            const.PAGE_HEIGHT - const.TOP_PADDING - table1_height,
-        )
-        table2 = Table(column_data[-5:], colWidths=[350] * 2)
-        # Define table style with increased font size
-        table2.setStyle(
-            TableStyle(
-                [
-                    (
-                        "BACKGROUND",
-                        (0, 0),
-                        (0, -1),
-                        colors.lightblue,
-                    ),  # Header background color
-                    (
-                        "TEXTCOLOR",
-                        (0, 0),
-                        (0, -1),
-                        colors.whitesmoke,
-                    ),  # Header text color
-                    ("ALIGN", (0, 0), (-1, -1), "LEFT"),
-                    ("FONTNAME", (0, 0), (-1, -1), "Poppins"),
-                    ("FONTSIZE", (0, 0), (-1, -1), 26),  # Increased font size
-                    (
-                        "VALIGN",
-                        (0, 0),
-                        (-1, -1),
-                        "TOP",
-                    ),  # Align text to the top of the cell
-                    ("BOTTOMPADDING", (0, 0), (-1, -1), 30),
-                    (
-                        "BACKGROUND",
-                        (1, 0),
-                        (1, -1),
-                        colors.beige,
-                    ),  # Body background color
-                    ("GRID", (0, 0), (-1, -1), 1, colors.black),
-                ]
-            )
-        )
-        # Wrap and draw the table
-        table2_width, table2_height = table2.wrap(
-            const.PAGE_WIDTH, const.PAGE_HEIGHT - const.TOP_PADDING
-        )
-        table2.drawOn(
-            pdf_canvas,
-            const.LR_PADDING + 1000,
-            const.PAGE_HEIGHT - const.TOP_PADDING - table2_height - 300,
-        )
 
-        img_list = db_imgs[idx]["img"].split(",")
-        infr_list = db_imgs[idx]["infr"].split(",")
-
-        if img_list:
-            pdf_canvas.drawImage(
-                img_list[0][1:],
-                const.LR_PADDING + 1000,
-                const.PAGE_HEIGHT - const.TOP_PADDING - 300,
-                width=700,
-                height=300,
-            )
-        pdf_canvas.showPage()
-        pdf_canvas.doForm("background_form")
-        for i in range(1, 3):
-            try:
-                pdf_canvas.drawImage(
-                    img_list[i][1:],
-                    const.LR_PADDING,
-                    const.PAGE_HEIGHT - const.TOP_PADDING - 330 * i,
-                    width=700,
-                    height=300,
-                )
-            except IndexError:
-                break
-        col = [[Paragraph("Infraestrutura:", custom_style)]] + [
-            [Paragraph(f"•  {c}", custom_style)] for c in infr_list
-        ]
-        table3 = Table(col, colWidths=const.PAGE_WIDTH / 2 - const.LR_PADDING)
-        # Define table style
-        table3.setStyle(
-            TableStyle(
-                [
-                    (
-                        "BACKGROUND",
-                        (1, 0),
-                        (-1, -1),
-                        colors.transparent,
-                    ),  # Body background color
-                    ("GRID", (0, 0), (-1, -1), 0, colors.transparent),
-                ]
-            )
-        )
-        # Wrap and draw the table
-        table3_width, table3_height = table3.wrap(
-            const.PAGE_WIDTH, const.PAGE_HEIGHT - const.TOP_PADDING
-        )
-        table3.drawOn(
-            pdf_canvas,
-            const.PAGE_WIDTH / 2,
-            const.PAGE_HEIGHT - const.TOP_PADDING - table3_height,
-        )
-
-        pdf_canvas.showPage()
-    # Last page (background 1.jpg)
-    pdf_canvas.drawImage(
-        const.LAST_PAGE_BGD, 0, 0, width=const.PAGE_WIDTH, height=const.PAGE_HEIGHT
-    )
-
-    # Bookmark the last page and add an outline entry
-    pdf_canvas.bookmarkPage("last_page")
-    pdf_canvas.addOutlineEntry("Last Page", "last_page", level=0)
-
-    # Save the PPTF
-    pdf_canvas.save()
+async def get_pdf_key(data: dict) -> str:
+    """pdf_cache key of the comparisons pdf, changes with any unit or property edit."""
+    ppt_type = int(data["ppt_type"])
+    ad_type = int(data["ad_type"])
+    where_fld, params = _cmp_where(data)
+    qry = f"""
+    SELECT cmp.id, cmp.ppt_id, COALESCE(v.version, 0) AS version,
+    m.id AS unit_id, m.last_update
+    FROM comparisons as cmp
+    LEFT JOIN properties as p ON cmp.ppt_id = p.id
+    LEFT JOIN ppt_versions as v ON cmp.ppt_id = v.ppt_id
+    LEFT JOIN {s.PPT_CMP_TABLES[ppt_type]} as cmp_m ON cmp.id = cmp_m.comparison_id
+    LEFT JOIN {s.PPT_TABLE_NAMES[ppt_type]} as m ON cmp_m.unit_id = m.id
+    {where_fld}
+    ORDER BY cmp.id, m.id
+    """
+    rows = [list(r.values()) for r in await aiodb.q(qry, params)]
+    return pdf_cache.get_key(ppt_type, ad_type, rows)
 
 
 def task_frm(sess: dict, prefil: dict = dict()):
@@ -1887,9 +1748,8 @@ def test(
         fh.Div(
             id=f"{field}_hidden"
         ),  # Container for hidden inputs (submitted with form)
-        fh.Script(
-            autocomplete_script(field, multiple)
-        ),  # Add the dynamic filtering and selection script
+        data_autocomplete=field,
+        data_multiple=multiple,  # js/autocomplete.js
     )
 
 
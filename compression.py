@@ -0,0 +1,168 @@
+import gzip
+import os
+import re
+import zlib
+from mimetypes import guess_type
+from pathlib import Path
+
+import const
+import fasthtml.common as fh
+import mysettings as s
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only
+    brotli = None
+
+# Text responses over COMPRESS_MIN_SIZE are compressed on the fly with
+# brotli or gzip, whichever the client accepts. Photos and pdfs are
+# compressed formats already and are sent as is. css/ and js/ files are
+# compressed once at startup into STATIC_CACHE_DIR and served from there.
+ENCODINGS = ("br", "gzip") if brotli else ("gzip",)
+_exts = {"br": ".br", "gzip": ".gz"}
+_refused_re = re.compile(r"\s*q\s*=\s*0(\.0*)?\s*")
+_etag_suffix_re = re.compile(r'-(br|gzip)"$')
+
+
+def get_encoding(headers: Headers) -> str | None:
+    """Preferred of ENCODINGS in the Accept-Encoding header."""
+    accepted = set()
+    for part in headers.get("accept-encoding", "").split(","):
+        name, _, params = part.partition(";")
+        if not _refused_re.fullmatch(params):
+            accepted.add(name.strip().lower())
+    return next((e for e in ENCODINGS if e in accepted), None)
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """ETag of the compressed representation, "tag" is "tag-br" for br."""
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def identity_etag(etag: str) -> str:
+    """ETag of the uncompressed representation of an encoded_etag."""
+    return _etag_suffix_re.sub('"', etag)
+
+
+def is_compressible(content_type: str | None) -> bool:
+    return bool(content_type) and content_type.startswith(const.COMPRESS_TYPES)
+
+
+def _compressor(encoding: str):
+    """compress(data) and finish() of a streaming compressor."""
+    if encoding == "br":
+        c = brotli.Compressor(quality=const.BROTLI_QUALITY)
+        return c.process, c.finish
+    c = zlib.compressobj(const.GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return c.compress, c.flush
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = const.COMPRESS_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        encoding = None
+        if scope["type"] == "http":
+            encoding = get_encoding(Headers(scope=scope))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+        start = None
+        compress = finish = None
+
+        async def send_compressed(message):
+            nonlocal start, compress, finish
+            if message["type"] == "http.response.start":
+                start = message  # sent with the first body, headers may change
+                return
+            if message["type"] != "http.response.body":
+                return await send(message)
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is not None:
+                headers = MutableHeaders(raw=start["headers"])
+                if (
+                    start["status"] not in (204, 206, 304)
+                    and "content-encoding" not in headers
+                    and is_compressible(headers.get("content-type"))
+                    and (more_body or len(body) >= self.minimum_size)
+                ):
+                    compress, finish = _compressor(encoding)
+                    headers["Content-Encoding"] = encoding
+                    headers.add_vary_header("Accept-Encoding")
+                    if "etag" in headers:
+                        headers["ETag"] = encoded_etag(headers["etag"], encoding)
+                    del headers["Content-Length"]
+                    body = compress(body) + (b"" if more_body else finish())
+                    if not more_body:
+                        headers["Content-Length"] = str(len(body))
+                await send(start)
+                start = None
+            elif compress is not None:
+                body = compress(body) + (b"" if more_body else finish())
+            await send({**message, "body": body})
+
+        await self.app(scope, receive, send_compressed)
+
+
+def _variant(src: Path, encoding: str) -> Path:
+    """Compressed copy of the file src of the project."""
+    return s.STATIC_CACHE_DIR / f"{src.relative_to(s.BASE_DIR)}{_exts[encoding]}"
+
+
+def precompress() -> None:
+    """Compress css/ and js/ files changed since their compressed copies."""
+    for src in (p for d in (s.CSS_DIR, s.JS_DIR) for p in d.rglob("*")):
+        if not (src.is_file() and is_compressible(guess_type(src)[0])):
+            continue
+        data = None
+        for encoding in ENCODINGS:
+            dst = _variant(src, encoding)
+            if dst.exists() and dst.stat().st_mtime >= src.stat().st_mtime:
+                continue
+            data = data or src.read_bytes()
+            if encoding == "br":
+                compressed = brotli.compress(data, quality=11)
+            else:
+                compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            tmp = dst.with_name(f"{dst.name}.{os.getpid()}.tmp")
+            tmp.write_bytes(compressed)
+            os.replace(tmp, dst)
+
+
+class PrecompressedFiles(fh.StaticFiles):
+    """
+    Static files served from their precompress copies if the client accepts
+    the encoding and the copy is not older than the file. Last-Modified of
+    the file is kept and the ETag gets the encoding suffix, so conditional
+    requests still work.
+    """
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        res = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        req_headers = Headers(scope=scope)
+        encoding = get_encoding(req_headers)
+        try:
+            dst = _variant(Path(full_path), encoding) if encoding else None
+            if dst and dst.stat().st_mtime < stat_result.st_mtime:
+                dst = None
+        except (ValueError, FileNotFoundError):  # outside of the project, no copy
+            dst = None
+        if dst is not None:
+            headers = MutableHeaders(
+                {k: v for k, v in res.headers.items() if k != "content-length"}
+            )
+            headers["Content-Encoding"] = encoding
+            headers["ETag"] = encoded_etag(res.headers["etag"], encoding)
+            headers.add_vary_header("Accept-Encoding")
+            res = FileResponse(
+                dst, status_code=status_code, headers=headers, media_type=res.media_type
+            )
+        if self.is_not_modified(res.headers, req_headers):
+            return NotModifiedResponse(res.headers)
+        return res
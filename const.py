@@ -1,4 +1,40 @@
-import mysettings as s
+from pathlib import Path
+
+
+# Choices stored in the db, mysettings re-exports them
+class Choice:
+    YES = 1
+    NO = 2
+    BOTH = 3
+
+
+class Role:
+    ADMIN = 1
+    USER = 2
+    BROKER = 3
+    OWNER = 4
+    SECRETARY = 5
+
+
+class AdType:
+    RENT = 1
+    SELL = 2
+
+
+class Status:
+    ACTIVE = 1
+    ARCHIVE = 2
+    NEW = 3
+    SUSPENDED = 4
+    SUCCESS = 5
+
+
+class PropertyType:
+    WAREHOUSE = 1
+    LAND = 2
+    OFFICE = 3
+    SHOP = 4
+
 
 DESCR = "test description"
 
@@ -16,62 +52,62 @@ FLTR_MULT_CHOICE_FLDS = (
 )
 
 EMPLOYEES = (
-    s.Role.BROKER,
-    s.Role.ADMIN,
-    s.Role.SECRETARY,
+    Role.BROKER,
+    Role.ADMIN,
+    Role.SECRETARY,
 )
 
 STATUS_TYPE = {
-    s.Status.ACTIVE: "Ativo",
-    s.Status.ARCHIVE: "Arquivado",
-    s.Status.NEW: "Novo",
+    Status.ACTIVE: "Ativo",
+    Status.ARCHIVE: "Arquivado",
+    Status.NEW: "Novo",
 }
 
 SECRETARY_REGISTER = {
-    s.Role.OWNER: "Proprietário",
-    s.Role.USER: "Usuário",
+    Role.OWNER: "Proprietário",
+    Role.USER: "Usuário",
 }
 
 ROLE_TYPE = {
-    s.Role.BROKER: "Corretor",
-    s.Role.ADMIN: "Administrador",
-    s.Role.SECRETARY: "Secretária",
+    Role.BROKER: "Corretor",
+    Role.ADMIN: "Administrador",
+    Role.SECRETARY: "Secretária",
     **SECRETARY_REGISTER,
 }
 
 ROLE_FLDS = {
-    "client_id": s.Role.USER,
-    "broker_id": s.Role.BROKER,
-    "owner_id": s.Role.OWNER,
+    "client_id": Role.USER,
+    "broker_id": Role.BROKER,
+    "owner_id": Role.OWNER,
 }
 
 ROLE_FK = {
-    s.Role.USER: "client_id",
-    s.Role.BROKER: "broker_id",
-    s.Role.OWNER: "owner_id",
+    Role.USER: "client_id",
+    Role.BROKER: "broker_id",
+    Role.OWNER: "owner_id",
 }
 
 CHOICE_TYPE = {
-    s.Choice.BOTH: "Tanto faz",
-    s.Choice.YES: "Sim",
-    s.Choice.NO: "Não",
+    Choice.BOTH: "Tanto faz",
+    Choice.YES: "Sim",
+    Choice.NO: "Não",
 }
 
 PPT_TYPE = {
-    s.PropertyType.WAREHOUSE: "Galpão",
-    s.PropertyType.LAND: "Terreno",
-    s.PropertyType.OFFICE: "Escritório",
-    s.PropertyType.SHOP: "Loja",
+    PropertyType.WAREHOUSE: "Galpão",
+    PropertyType.LAND: "Terreno",
+    PropertyType.OFFICE: "Escritório",
+    PropertyType.SHOP: "Loja",
 }
 
 AD_TYPE = {
-    s.AdType.RENT: "Locacão",
-    s.AdType.SELL: "Venta",
+    AdType.RENT: "Locacão",
+    AdType.SELL: "Venta",
 }
 
 AD_TYPE_FLDS = {
-    s.AdType.RENT: "rent",
-    s.AdType.SELL: "sell",
+    AdType.RENT: "rent",
+    AdType.SELL: "sell",
 }
 
 R_M2 = "R$/m2"
@@ -160,7 +196,57 @@ RANGES = {
     # 'last_update': {'minimum': 0, 'step': 10, 'maximum': 1000},
 }
 
+# Max number of properties returned by /ppts/map per request
+MAP_LIMIT = 200
+KM_PER_DEG = 111.32  # km in one degree of latitude
+# Rendered property views kept per process, see cache.py
+PPT_VIEW_CACHE_SIZE = 512
+# Max number of options returned by /autocomplete
+AUTOCOMPLETE_LIMIT = 10
+
+# Geocoder results are cached for this many seconds, see geocoding.py
+GEOCODE_TTL = 90 * 24 * 3600
+GEOCODE_MISS_TTL = 24 * 3600  # addresses the geocoder did not find
+GEOCODE_BATCH = 10  # addresses geocoded at once by the worker
+GEOCODE_MAX_ATTEMPTS = 5
+GEOCODE_RETRY_DELAY = 30  # seconds before the first retry, doubled after each
+GEOCODE_RATE = 10  # max geocoder requests per second of python geocoding.py
+FAKE_GEOCODE_BOUNDS = (-24.0, -47.0, -23.3, -46.3)  # south, west, north, east
+
+# Uploads are copied to disk in chunks, max size per file in bytes by path
+UPLOAD_CHUNK_SIZE = 1024**2
+UPLOAD_MAX_BYTES = {"imgs": 20 * 1024**2, "pdfs": 100 * 1024**2}
+
+# Cache-Control of files with content hash in the name
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+# Pages revalidated with ETag on every view, see main.validators
+REVALIDATE_CACHE = "private, no-cache"
+
+# Response compression, see compression.py. Brotli is used if installed.
+COMPRESS_MIN_SIZE = 1024  # bytes, smaller responses are sent as is
+COMPRESS_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "image/svg+xml",
+)
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Photo variants made on upload, max width in px, see images.py
+IMG_VARIANTS = {"full": 1600, "card": 640, "thumb": 320}
+IMG_QUALITY = 82
+IMG_WORKERS = 4  # threads resizing uploaded photos
+
 # PDF creation section
+PDF_WORKERS = 2  # processes rendering pdfs, see pdf_jobs.py
+PDF_QUEUE_SIZE = 8  # max pending and running pdf jobs
+PDF_WAIT = 5  # seconds /download_pdf waits before returning job status
+PDF_JOB_TTL = 600  # seconds a finished job is kept for download
+PDF_CACHE_DIR = Path(__file__).resolve().parent / "cache" / "pdfs"
+PDF_CACHE_MAX_BYTES = 500 * 1024**2  # rendered pdfs kept on disk, see pdf_cache.py
+PDF_LAYOUT_VERSION = 1  # part of pdf cache key, bump when pdf_builder output changes
+
 # Page size (2000px by 1414px)
 PAGE_WIDTH = 2000
 PAGE_HEIGHT = 1414
@@ -169,6 +255,9 @@ PAGE_HEIGHT = 1414
 LR_PADDING = 100
 TOP_PADDING = 600
 
+PDF_FONT = "assets/fonts/Poppins-Regular.ttf"
+PDF_IMG_SIZE = (1400, 600)  # px of the 700x300 photo slots, 2x for zoom
+PDF_IMG_QUALITY = 80
 COVER_BGD = "assets/backgrounds/cover.jpg"
 BODY_BGD = "assets/backgrounds/body.jpg"
 ABOUT_BGD = "assets/backgrounds/about.jpg"  # will be changed with code, probably
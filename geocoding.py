@@ -0,0 +1,310 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+
+import aiodb
+import const
+import mysettings as s
+
+# Geocoder is a blocking callable, address string -> {"lat", "lng"} or None.
+# Results are cached in s.geocodes by the normalized address, misses too.
+# Addresses are saved without location and queued in s.geocode_queue,
+# the worker task started with the app fills addresses.location in.
+_client = None
+_wake: asyncio.Event | None = None
+_worker: asyncio.Task | None = None
+
+
+def google_geocoder(address: str) -> dict | None:
+    """Geocode with Google Maps API, the client is created on first use."""
+    global _client
+    if _client is None:
+        import googlemaps
+
+        _client = googlemaps.Client(key=s.GOOGLE_API)
+    result = _client.geocode(address)
+    if result:
+        return result[0]["geometry"]["location"]
+    return None
+
+
+def fake_geocoder(address: str) -> dict | None:
+    """
+    Local stand-in for tests and benchmarks, no network. Same address gets
+    the same point inside const.FAKE_GEOCODE_BOUNDS.
+    """
+    south, west, north, east = const.FAKE_GEOCODE_BOUNDS
+    digest = hashlib.sha256(address.encode()).digest()
+    x, y = (int.from_bytes(digest[i : i + 4], "big") / 2**32 for i in (0, 4))
+    return {"lat": south + (north - south) * x, "lng": west + (east - west) * y}
+
+
+geocoder = google_geocoder
+# geocodes has results of the default geocoder only
+_cached = True
+
+
+def set_geocoder(fn, cached: bool = False) -> None:
+    """
+    Replace the geocoder used on cache misses. The geocodes cache is
+    bypassed unless cached is set, for wrappers of the default geocoder.
+    """
+    global geocoder, _cached
+    geocoder = fn
+    _cached = cached
+
+
+def get_key(cep, street, number, city) -> str:
+    """Cache key of the address, case, accents and cep punctuation ignored."""
+    cep = re.sub(r"\D", "", str(cep or ""))
+    parts = (s.normalize_name(p) or "" for p in (street, number, city))
+    return "|".join((cep, *parts))
+
+
+async def geocode(cep, street, number, city, region=None) -> dict | None:
+    """Location of the address. Geocoder is called only on a cache miss."""
+    address = ", ".join(str(p) for p in (cep, street, number, city, region) if p)
+    if not _cached:
+        return await asyncio.to_thread(geocoder, address)
+    key = get_key(cep, street, number, city)
+    row = await aiodb.first(
+        "SELECT location FROM geocodes WHERE key = ? AND expires > ?",
+        (key, int(time.time())),
+    )
+    if row:
+        return json.loads(row["location"]) if row["location"] else None
+    location = await asyncio.to_thread(geocoder, address)
+    ttl = const.GEOCODE_TTL if location else const.GEOCODE_MISS_TTL
+    await aiodb.execute(
+        "INSERT OR REPLACE INTO geocodes (key, location, expires) VALUES (?, ?, ?)",
+        (key, json.dumps(location) if location else None, int(time.time()) + ttl),
+    )
+    return location
+
+
+async def enqueue(adrs_id: int) -> None:
+    """Queue the address for the worker, again if it is queued already."""
+    await aiodb.execute(
+        "INSERT INTO geocode_queue (adrs_id, attempts, next_try, queued) "
+        "VALUES (?, 0, 0, ?) ON CONFLICT (adrs_id) DO UPDATE SET "
+        "attempts = 0, next_try = 0, queued = excluded.queued",
+        (adrs_id, time.time()),
+    )
+    if _wake is not None:
+        _wake.set()
+
+
+_adrs_qry = """
+SELECT a.id AS adrs_id, a.cep, a.str_number,
+st.name AS street, ci.name AS city, r.name AS region{cols}
+FROM addresses AS a
+LEFT JOIN streets AS st ON st.id = a.street_id
+LEFT JOIN cities AS ci ON ci.id = a.city_id
+LEFT JOIN regions AS r ON r.id = a.region_id
+{join}
+WHERE {where}
+ORDER BY {order}
+LIMIT ?
+"""
+_pending_qry = _adrs_qry.format(
+    cols=", q.attempts, q.queued",
+    join="JOIN geocode_queue AS q ON q.adrs_id = a.id",
+    where="q.next_try <= ?",
+    order="q.next_try",
+)
+
+
+async def _geocode_adrs(row: dict) -> dict | None:
+    """Geocode _adrs_qry row."""
+    adrs = (row["cep"], row["street"], row["str_number"], row["city"])
+    return await geocode(*adrs, row["region"])
+
+
+def _location_stmt(adrs_id: int, location: dict | None) -> tuple[str, tuple]:
+    """Statement storing the location, the old one is kept if none was found."""
+    return (
+        "UPDATE addresses SET location = coalesce(?, location), geocoded = ? "
+        "WHERE id = ?",
+        (json.dumps(location) if location else None, int(time.time()), adrs_id),
+    )
+
+
+async def _process(row: dict) -> None:
+    """
+    Geocode the queued address. Failed calls are retried with exponential
+    backoff. The row is left alone if the address was queued again meanwhile.
+    """
+    same = "adrs_id = ? AND queued = ?"
+    dequeue = (
+        f"DELETE FROM geocode_queue WHERE {same}",
+        (row["adrs_id"], row["queued"]),
+    )
+    try:
+        location = await _geocode_adrs(row)
+    except Exception as e:  # network or geocoder api error
+        attempts = row["attempts"] + 1
+        if attempts < const.GEOCODE_MAX_ATTEMPTS:
+            delay = const.GEOCODE_RETRY_DELAY * 2 ** (attempts - 1)
+            await aiodb.execute(
+                f"UPDATE geocode_queue SET attempts = ?, next_try = ? WHERE {same}",
+                (attempts, time.time() + delay, row["adrs_id"], row["queued"]),
+            )
+            return
+        print(f"Geocoding of address {row['adrs_id']} failed: {e!r}")
+        await aiodb.execute(*dequeue)
+        return
+    # the location is not lost if the worker stops in between
+    await aiodb.transaction(_location_stmt(row["adrs_id"], location), dequeue)
+
+
+async def _run_batch() -> None:
+    """Process due addresses, or wait for new ones or the next retry."""
+    _wake.clear()
+    rows = await aiodb.q(_pending_qry, (time.time(), const.GEOCODE_BATCH))
+    if rows:
+        done = await asyncio.gather(
+            *(_process(row) for row in rows), return_exceptions=True
+        )
+        for e in done:
+            if isinstance(e, Exception):
+                raise e
+        return
+    row = await aiodb.first("SELECT MIN(next_try) AS next_try FROM geocode_queue")
+    timeout = None
+    if row["next_try"] is not None:
+        timeout = max(0, row["next_try"] - time.time())
+    try:
+        await asyncio.wait_for(_wake.wait(), timeout)
+    except TimeoutError:
+        pass
+
+
+async def _run() -> None:
+    # db errors do not stop the worker, the queue is tried again later
+    failures = 0
+    while True:
+        try:
+            await _run_batch()
+            failures = 0
+        except Exception as e:
+            delay = const.GEOCODE_RETRY_DELAY * 2 ** min(
+                failures, const.GEOCODE_MAX_ATTEMPTS - 1
+            )
+            failures += 1
+            print(f"Geocoding worker error, retrying in {delay}s: {e!r}")
+            await asyncio.sleep(delay)
+
+
+async def start_worker() -> None:
+    """Start the queue worker, called on app startup."""
+    global _wake, _worker
+    _wake = asyncio.Event()
+    _worker = asyncio.create_task(_run(), name="geocoding")
+
+
+async def stop_worker() -> None:
+    global _worker
+    if _worker is not None:
+        _worker.cancel()
+        _worker = None
+
+
+def _rate_limited(fn, rate: float):
+    """Geocoder calling fn at most rate times per second, from any thread."""
+    lock = threading.Lock()
+    next_call = 0.0
+
+    def limited(address: str) -> dict | None:
+        nonlocal next_call
+        with lock:
+            now = time.monotonic()
+            wait = next_call - now
+            next_call = max(now, next_call) + 1 / rate
+        if wait > 0:
+            time.sleep(wait)
+        return fn(address)
+
+    return limited
+
+
+# Addresses without location, or geocoded longer than GEOCODE_TTL ago
+_missing = "(a.lat IS NULL OR a.lng IS NULL)"
+_stale = f"({_missing} OR a.geocoded IS NULL OR a.geocoded < ?)"
+
+
+def _read_cursor() -> int:
+    try:
+        return int(s.GEOCODE_CURSOR_FILE.read_text())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+async def _backfill(args) -> None:
+    set_geocoder(_rate_limited(geocoder, args.rate), cached=_cached)
+    s.GEOCODE_CURSOR_FILE.parent.mkdir(exist_ok=True)
+    cursor = 0 if args.restart else _read_cursor()
+    where, params = (
+        (_stale, [time.time() - const.GEOCODE_TTL]) if args.stale else (_missing, [])
+    )
+    total = (
+        await aiodb.first(
+            f"SELECT COUNT(*) AS n FROM addresses AS a WHERE a.id > ? AND {where}",
+            [cursor, *params],
+        )
+    )["n"]
+    qry = _adrs_qry.format(
+        cols="", join="", where=f"a.id > ? AND {where}", order="a.id"
+    )
+    sem = asyncio.Semaphore(args.concurrency)
+    done = located = failed = 0
+    start = time.monotonic()
+
+    async def backfill_one(row: dict) -> None:
+        nonlocal located, failed
+        async with sem:
+            try:
+                location = await _geocode_adrs(row)
+            except Exception as e:  # network or geocoder api error
+                failed += 1
+                print(f"Address {row['adrs_id']}: {e!r}")
+                return
+        await aiodb.execute(*_location_stmt(row["adrs_id"], location))
+        located += location is not None
+
+    print(f"{total} addresses to geocode, starting after id {cursor}")
+    while rows := await aiodb.q(qry, [cursor, *params, args.batch]):
+        await asyncio.gather(*(backfill_one(row) for row in rows))
+        done += len(rows)
+        cursor = rows[-1]["adrs_id"]
+        # failed rows are picked up again by the next run with --restart
+        s.GEOCODE_CURSOR_FILE.write_text(str(cursor))
+        rate = done / (time.monotonic() - start)
+        print(
+            f"{done}/{total} done, {located} located, {failed} failed, "
+            f"{rate:.1f} addresses/s, cursor {cursor}"
+        )
+    s.GEOCODE_CURSOR_FILE.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    # python geocoding.py geocodes addresses without location, see --help
+    parser = argparse.ArgumentParser(description="Geocode addresses in bulk.")
+    parser.add_argument(
+        "--stale", action="store_true", help="also geocoded before GEOCODE_TTL"
+    )
+    parser.add_argument(
+        "--restart", action="store_true", help="ignore the saved cursor"
+    )
+    parser.add_argument("--batch", type=int, default=const.GEOCODE_BATCH)
+    parser.add_argument("--concurrency", type=int, default=const.GEOCODE_BATCH)
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=const.GEOCODE_RATE,
+        help="max geocoder requests per second",
+    )
+    asyncio.run(_backfill(parser.parse_args()))
@@ -0,0 +1,103 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import const
+from PIL import Image, ImageOps
+
+# Derivatives are stored next to the original as {stem}.{variant}.jpg
+
+# Pillow releases the GIL while decoding and resizing
+_executor = ThreadPoolExecutor(
+    max_workers=const.IMG_WORKERS, thread_name_prefix="images"
+)
+
+
+def _variant_path(path: Path, variant: str) -> Path:
+    return path.with_name(f"{path.stem}.{variant}.jpg")
+
+
+def pdf_variant(path: str) -> str:
+    """
+    Photo cropped and scaled for the pdf photo slots. Made once, and again
+    only if the original is newer. Smaller photos are not upscaled.
+    """
+    src = Path(path)
+    dst = _variant_path(src, "pdf")
+    try:
+        if dst.stat().st_mtime >= src.stat().st_mtime:
+            return str(dst)
+    except FileNotFoundError:
+        pass
+    w, h = const.PDF_IMG_SIZE
+    with Image.open(src) as im:
+        im = ImageOps.exif_transpose(im).convert("RGB")
+        scale = min(1, im.width / w, im.height / h)
+        size = (round(w * scale), round(h * scale))
+        im = ImageOps.fit(im, size, Image.Resampling.LANCZOS)
+    # pdf workers may make the same derivative at once
+    tmp = dst.with_name(f"{dst.name}.{os.getpid()}.tmp")
+    im.save(tmp, "JPEG", quality=const.PDF_IMG_QUALITY, optimize=True)
+    os.replace(tmp, dst)
+    return str(dst)
+
+
+def _make_variants(path: Path) -> list[dict]:
+    """Resize the photo to IMG_VARIANTS widths, from the largest down."""
+    variants = []
+    with Image.open(path) as im:
+        im = ImageOps.exif_transpose(im).convert("RGB")
+        for variant, width in sorted(const.IMG_VARIANTS.items(), key=lambda v: -v[1]):
+            if im.width > width or not variants:
+                if im.width > width:
+                    height = max(1, round(im.height * width / im.width))
+                    im = im.resize((width, height), Image.Resampling.LANCZOS)
+                dst = _variant_path(path, variant)
+                im.save(dst, "JPEG", quality=const.IMG_QUALITY, optimize=True)
+            # small photo, the larger variant file is reused
+            variants.append(
+                {
+                    "variant": variant,
+                    "path": dst,
+                    "width": im.width,
+                    "height": im.height,
+                }
+            )
+    return variants
+
+
+async def make_variants(path: Path) -> list[dict]:
+    """
+    Photo variants (thumb, card, full) made on the images pool.
+    Return dicts with variant, path, width and height.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _make_variants, path)
+
+
+def delete_variants(path: Path, variants: list[Path]) -> None:
+    """Remove the variants and the pdf derivative of the original photo."""
+    for variant in (*variants, _variant_path(path, "pdf")):
+        variant.unlink(missing_ok=True)
+
+
+async def _backfill() -> None:
+    import components as c
+    import mysettings as s
+
+    qry = """
+    SELECT id, name FROM ppt_images AS pi WHERE NOT EXISTS (
+        SELECT 1 FROM ppt_image_variants WHERE image_id = pi.id
+    )
+    """
+    for img in s.db.q(qry):
+        try:
+            await c.save_img_variants(img)
+        except OSError as e:
+            print(f"{img['name']}: {e}")
+
+
+if __name__ == "__main__":
+    # python images.py makes variants of photos uploaded before them
+    asyncio.run(_backfill())
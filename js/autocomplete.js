@@ -0,0 +1,96 @@
+// Autocomplete fields of get_autocomplete_for, <div data-autocomplete="{field}">
+// with data-multiple for several values. Options are loaded by htmx from
+// /autocomplete/{field} into {field}_dropdown while typing. Selected values
+// of multiple fields are shown in {field}_selected and submitted with
+// hidden inputs in {field}_hidden.
+
+function parts(container) {
+  const prefix = container.dataset.autocomplete;
+  const el = (suffix) => document.getElementById(prefix + suffix);
+  return {
+    prefix: prefix,
+    multiple: "multiple" in container.dataset,
+    input: el(""),
+    dropdown: el("_dropdown"),
+    selected: el("_selected"),
+    hidden: el("_hidden"),
+  };
+}
+
+function hiddenId(prefix, value) {
+  return prefix + "_hidden_" + value.replace(/\s+/g, "_");
+}
+
+// Add a selected option below the input and a hidden input with its value
+function addSelectedOption(p, value) {
+  const existing = [...p.selected.querySelectorAll("span")].map((option) =>
+    option.firstChild.textContent.trim(),
+  );
+  if (existing.includes(value)) return;
+  const item = document.createElement("span");
+  item.className = "selected-item";
+  const button = document.createElement("button");
+  button.type = "button";
+  button.dataset.remove = value;
+  button.textContent = "x";
+  item.append(value + " ", button);
+  p.selected.appendChild(item);
+
+  const hiddenInput = document.createElement("input");
+  hiddenInput.type = "hidden";
+  hiddenInput.name = p.prefix;
+  hiddenInput.value = value;
+  hiddenInput.id = hiddenId(p.prefix, value);
+  p.hidden.appendChild(hiddenInput);
+}
+
+function choose(p, value) {
+  if (p.multiple) {
+    addSelectedOption(p, value);
+    p.input.value = "";
+  } else {
+    p.input.value = value;
+  }
+  p.dropdown.style.display = "none";
+}
+
+document.addEventListener("htmx:afterSwap", (evt) => {
+  const container = evt.target.closest("[data-autocomplete]");
+  if (!container) return;
+  const { dropdown } = parts(container);
+  if (evt.target === dropdown) {
+    dropdown.style.display = dropdown.children.length ? "block" : "none";
+  }
+});
+
+document.addEventListener("click", (evt) => {
+  const container = evt.target.closest("[data-autocomplete]");
+  // Close dropdowns when clicking outside their input or dropdown
+  document.querySelectorAll("[data-autocomplete]").forEach((other) => {
+    const { input, dropdown } = parts(other);
+    if (!input.contains(evt.target) && !dropdown.contains(evt.target)) {
+      dropdown.style.display = "none";
+    }
+  });
+  if (!container) return;
+  const p = parts(container);
+  const remove = evt.target.closest("button[data-remove]");
+  if (remove) {
+    remove.parentElement.remove();
+    document.getElementById(hiddenId(p.prefix, remove.dataset.remove))?.remove();
+    return;
+  }
+  const option = evt.target.closest("li");
+  if (option && p.dropdown.contains(option)) choose(p, option.textContent);
+});
+
+// Enter adds a custom value instead of submitting the form
+document.addEventListener("keydown", (evt) => {
+  const container = evt.target.closest("[data-autocomplete]");
+  if (!container || evt.key !== "Enter") return;
+  const p = parts(container);
+  if (evt.target !== p.input) return;
+  evt.preventDefault();
+  const value = p.input.value.trim();
+  if (value) choose(p, value);
+});
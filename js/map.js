@@ -0,0 +1,175 @@
+// Google maps of <div data-map="locations|comparisons">. The maps API script
+// calls window.initMap once loaded, maps of htmx swaps are set up afterwards.
+//
+// locations: properties of the current viewport, fetched from /ppts/map with
+// the filter params data-fltr after the map stops moving. Up to
+// data-cluster-max-zoom markers are server side clusters from /ppts/clusters.
+// Property links get data-query appended.
+// comparisons: server side clusters of the user comparisons from
+// /comparisons/clusters with the params data-query.
+
+const ready = new WeakSet();
+
+function newMap(el) {
+  return new google.maps.Map(el, {
+    zoom: 4,
+    center: { lat: -23.533773, lng: -46.62529 },
+    mapId: "DEMO_MAP_ID",
+  });
+}
+
+// Marker of a server side cluster, click zooms into the cluster
+function clusterMarker(map, cl) {
+  const marker = new google.maps.Marker({
+    position: { lat: cl.lat, lng: cl.lng },
+    map: map,
+    label: cl.n > 1 ? String(cl.n) : undefined,
+    title: cl.price != null ? `Preço a partir de: ${cl.price} R$/m2` : "",
+  });
+  if (cl.n > 1) {
+    marker.addListener("click", () => {
+      map.setCenter(marker.getPosition());
+      map.setZoom(map.getZoom() + 2);
+    });
+  }
+  return marker;
+}
+
+// Debounce map movements, 'idle' fires once panning or zooming stops
+function onIdle(map, fn) {
+  let timer = null;
+  map.addListener("idle", () => {
+    clearTimeout(timer);
+    timer = setTimeout(fn, 250);
+  });
+}
+
+function card(poi, query) {
+  return `
+    <article class="card">
+      <div class="carousel">
+        ${poi.images.map((img, index) => `
+          <div class="carousel-item ${index === 0 ? "active" : ""}">
+            <img src="${img.src}" srcset="${img.srcset}" sizes="(max-width: 600px) 100vw, 400px" alt="Image ${index + 1}" loading="lazy">
+          </div>
+        `).join("")}
+        <button class="carousel-control left" type="button" data-slide="-1">&#10094;</button>
+        <button class="carousel-control right" type="button" data-slide="1">&#10095;</button>
+      </div>
+      <a href="/ppts/${poi.id}${query}" style="text-decoration: none; color: inherit;" target="blank">
+        <div class="content">
+          <h5>${poi.ppt_type}: ${poi.name}</h5>
+          <h6>Preço a partir de: ${poi.price} R$/m2</h6>
+          <p>Area disponivel: ${poi.min_area} - ${poi.max_area} m2</p>
+          <p>${poi.street}, ${poi.city}</p>
+        </div>
+      </a>
+    </article>
+  `;
+}
+
+function locationsMap(el) {
+  const map = newMap(el);
+  const fltr = el.dataset.fltr;
+  const query = el.dataset.query;
+  const clusterMaxZoom = parseInt(el.dataset.clusterMaxZoom);
+  const locationList = document.getElementById("location-list");
+  let markers = [];
+  let cursor = null;
+  let controller = null;
+
+  // Fetch a page of properties inside the current viewport
+  async function loadLocations(append) {
+    const bounds = map.getBounds();
+    if (!bounds) return;
+    const sw = bounds.getSouthWest();
+    const ne = bounds.getNorthEast();
+    const params = new URLSearchParams(fltr);
+    params.set("south", sw.lat());
+    params.set("west", sw.lng());
+    params.set("north", ne.lat());
+    params.set("east", ne.lng());
+    params.set("zoom", map.getZoom());
+    const clustered = map.getZoom() <= clusterMaxZoom;
+    if (append && cursor) params.set("cursor", cursor);
+    if (controller) controller.abort();
+    controller = new AbortController();
+    const signal = controller.signal;
+    let data, clusters;
+    try {
+      [data, clusters] = await Promise.all([
+        fetch(`/ppts/map?${params}`, { signal }).then((resp) => resp.json()),
+        clustered && !append
+          ? fetch(`/ppts/clusters?${params}`, { signal }).then((resp) => resp.json())
+          : null,
+      ]);
+    } catch (err) {
+      return; // request was replaced by a newer one
+    }
+    if (!append) {
+      markers.forEach((marker) => marker.setMap(null));
+      markers = [];
+      locationList.innerHTML = "";
+    }
+    if (clusters) {
+      markers = clusters.clusters.map((cl) => clusterMarker(map, cl));
+    } else if (!clustered) {
+      markers.push(
+        ...data.items
+          .filter((poi) => poi.location)
+          .map((poi) => new google.maps.Marker({ position: poi.location, map: map, title: poi.name })),
+      );
+    }
+    cursor = data.cursor;
+    document.getElementById("location-more")?.remove();
+    locationList.insertAdjacentHTML("beforeend", data.items.map((poi) => card(poi, query)).join(""));
+    if (cursor) {
+      locationList.insertAdjacentHTML("beforeend", '<button id="location-more" type="button">Mostrar mais</button>');
+      document.getElementById("location-more").addEventListener("click", () => loadLocations(true));
+    }
+  }
+
+  onIdle(map, () => loadLocations(false));
+}
+
+function comparisonsMap(el) {
+  const map = newMap(el);
+  let markers = [];
+
+  async function loadClusters() {
+    const params = new URLSearchParams(el.dataset.query);
+    params.set("zoom", map.getZoom());
+    const resp = await fetch(`/comparisons/clusters?${params}`);
+    const data = await resp.json();
+    markers.forEach((marker) => marker.setMap(null));
+    markers = data.clusters.map((cl) => clusterMarker(map, cl));
+  }
+
+  onIdle(map, loadClusters);
+}
+
+const maps = { locations: locationsMap, comparisons: comparisonsMap };
+
+// Set up maps not set up yet, called by the maps API script when loaded
+window.initMap = function () {
+  document.querySelectorAll("[data-map]").forEach((el) => {
+    if (ready.has(el)) return;
+    ready.add(el);
+    maps[el.dataset.map](el);
+  });
+};
+
+document.addEventListener("htmx:afterSettle", () => {
+  if (window.google?.maps?.Map) window.initMap();
+});
+
+// Carousel of the property cards
+document.addEventListener("click", (evt) => {
+  const button = evt.target.closest(".carousel [data-slide]");
+  if (!button) return;
+  const items = [...button.closest(".carousel").querySelectorAll(".carousel-item")];
+  const current = items.findIndex((item) => item.classList.contains("active"));
+  const next = (current + parseInt(button.dataset.slide) + items.length) % items.length;
+  items[current].classList.remove("active");
+  items[next].classList.add("active");
+});
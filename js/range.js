@@ -0,0 +1,65 @@
+// Min/max sliders of range_container, <div data-range="{field}">.
+// Number inputs are {field}_min/_max, sliders {field}_min_handler/_max_handler.
+
+function parts(container) {
+  const prefix = container.dataset.range;
+  const el = (suffix) => document.getElementById(prefix + suffix);
+  return {
+    minHandler: el("_min_handler"),
+    maxHandler: el("_max_handler"),
+    minInput: el("_min"),
+    maxInput: el("_max"),
+    range: el("_selected"),
+  };
+}
+
+// Color the track between the two slider handles
+function fillRange({ minHandler, maxHandler, range }) {
+  const rangeMin = parseInt(minHandler.min);
+  const rangeMax = parseInt(maxHandler.max);
+  const minValue = Math.min(minHandler.value, maxHandler.value);
+  const maxValue = Math.max(minHandler.value, maxHandler.value);
+  range.style.left = ((minValue - rangeMin) / (rangeMax - rangeMin)) * 100 + "%";
+  range.style.right = ((rangeMax - maxValue) / (rangeMax - rangeMin)) * 100 + "%";
+}
+
+function updateSliderValues(container) {
+  const p = parts(container);
+  let minValue = parseInt(p.minHandler.value);
+  let maxValue = parseInt(p.maxHandler.value);
+  // Handles may cross, the left one is the minimum
+  if (minValue > maxValue) [minValue, maxValue] = [maxValue, minValue];
+  p.minInput.value = minValue;
+  p.maxInput.value = maxValue;
+  fillRange(p);
+}
+
+function updateInputFields(container) {
+  const p = parts(container);
+  let minValue = parseInt(p.minInput.value);
+  const maxValue = parseInt(p.maxInput.value);
+  // Prevent the minimum input from exceeding the maximum input
+  if (minValue > maxValue) minValue = 0;
+  p.minHandler.value = minValue;
+  p.maxHandler.value = maxValue;
+  updateSliderValues(container);
+}
+
+document.addEventListener("input", (evt) => {
+  const container = evt.target.closest("[data-range]");
+  if (container && evt.target.type === "range") updateSliderValues(container);
+});
+
+document.addEventListener("change", (evt) => {
+  const container = evt.target.closest("[data-range]");
+  if (container && evt.target.type === "number") updateInputFields(container);
+});
+
+function init(root) {
+  if (root.matches?.("[data-range]")) updateSliderValues(root);
+  root.querySelectorAll("[data-range]").forEach(updateSliderValues);
+}
+
+// Sliders of the page and of every htmx swap, fill_form may set values
+init(document);
+document.addEventListener("htmx:load", (evt) => init(evt.detail.elt));
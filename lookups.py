@@ -0,0 +1,85 @@
+import threading
+
+import mysettings as s
+
+# Process wide name_norm -> id maps of s.LOOKUP_FK tables, loaded lazily.
+# Names missing from a map are looked up in the db, rows added by other
+# processes are picked up. Renames must call invalidate(), other processes
+# resolve the old name to the renamed row until they restart.
+_cache: dict[str, dict[str, int]] = {}
+_lock = threading.Lock()
+
+
+def _ids_for(field: str) -> dict[str, int]:
+    """Cached ids of the field table. Call with _lock held."""
+    ids = _cache.get(field)
+    if ids is None:
+        tbl = s.LOOKUP_FK[field]
+        rows = s.db.execute(
+            f"SELECT name_norm, id FROM {tbl.name} WHERE name_norm IS NOT NULL"
+        )
+        ids = _cache[field] = dict(rows.fetchall())
+    return ids
+
+
+def _fetch(field: str, ids: dict[str, int], keys) -> None:
+    """Add ids of the keys existing in the db to ids. Call with _lock held."""
+    keys = tuple(keys)
+    if not keys:
+        return
+    placeholders = ", ".join("?" for _ in keys)
+    rows = s.db.execute(
+        f"SELECT name_norm, id FROM {s.LOOKUP_FK[field].name} "
+        f"WHERE name_norm IN ({placeholders})",
+        keys,
+    )
+    ids.update(rows.fetchall())
+
+
+def invalidate(field: str | None = None) -> None:
+    """Drop cached ids of the field, or of all fields."""
+    with _lock:
+        if field is None:
+            _cache.clear()
+        else:
+            _cache.pop(field, None)
+
+
+def get_ids(field: str, names: list) -> list[int]:
+    """Ids of existing items with these names. Unknown names are skipped."""
+    keys = {s.normalize_name(n) for n in names if n}
+    with _lock:
+        ids = _ids_for(field)
+        _fetch(field, ids, keys - ids.keys())
+        return [ids[k] for k in keys if k in ids]
+
+
+def get_or_create_many(field: str, names: list) -> list[int]:
+    """
+    Ids of items with these names in the same order. Missing items are
+    inserted and selected back in one statement each.
+    """
+    keys = [s.normalize_name(n) for n in names]
+    with _lock:
+        ids = _ids_for(field)
+        _fetch(field, ids, {k for k in keys if k not in ids})
+        new = {}
+        for k, n in zip(keys, names):
+            if k not in ids:
+                new.setdefault(k, n.strip())
+        if new:
+            tbl = s.LOOKUP_FK[field].name
+            # another process could insert the same name, hence DO NOTHING
+            with s.db.conn:
+                s.db.conn.executemany(
+                    f"INSERT INTO {tbl} (name, name_norm) VALUES (?, ?) "
+                    "ON CONFLICT (name_norm) DO NOTHING",
+                    [(n, k) for k, n in new.items()],
+                )
+            _fetch(field, ids, new)
+        return [ids[k] for k in keys]
+
+
+def get_or_create(field: str, name: str) -> int:
+    """Get or create item in db. Return item id"""
+    return get_or_create_many(field, [name])[0]
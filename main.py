@@ -1,15 +1,29 @@
+import asyncio
+import hashlib
+import sqlite3
 import time
 from datetime import datetime as dt
 from hmac import compare_digest
+from urllib.parse import urlencode
 
+import aiodb
+import blobs
+import bundles
+import cache
 import components as c
+import compression
 import const
 import fasthtml.common as fh
+import geocoding
+import lookups
 import mysettings as s
+import pdf_cache
+import pdf_jobs
 from starlette.background import BackgroundTask
 
 hdrs = [
     fh.Link(href="/css/main.css", rel="stylesheet"),
+    *(bundles.script(name) for name in ("range.js", "autocomplete.js", "map.js")),
 ]
 login_redir = fh.RedirectResponse("/login", status_code=303)
 
@@ -33,18 +47,72 @@ bware = fh.Beforeware(
         "/register",
         r"/ppts.*",
         r"/filter.*",
+        r"/autocomplete/(city|region|district|street|avcb|infr)_id",
     ],
 )
 
 bodykw = {"class": "relative bg-black font-geist text-black/80 font-details-off"}
 
-app, rt = fh.fast_app(before=bware, hdrs=hdrs, bodykw=bodykw, live=True, debug=True)
+app, rt = fh.fast_app(
+    before=bware,
+    hdrs=hdrs,
+    bodykw=bodykw,
+    live=True,
+    debug=True,
+    middleware=[fh.Middleware(compression.CompressionMiddleware)],
+    on_startup=[compression.precompress, geocoding.start_worker],
+    on_shutdown=[geocoding.stop_worker],
+)
 app.mount("/pdfs", fh.StaticFiles(directory="./pdfs"), name="pdfs")
-app.mount("/imgs", fh.StaticFiles(directory="./imgs"), name="imgs")
+
+
+class ImgFiles(fh.StaticFiles):
+    """Photos, content addressed blobs are cached by browsers for good."""
+
+    async def get_response(self, path: str, scope):
+        res = await super().get_response(path, scope)
+        if res.status_code in (200, 304) and blobs.is_blob(path):
+            res.headers["Cache-Control"] = const.IMMUTABLE_CACHE
+        return res
+
+
+# ahead of the fast_app static files route, which matches /imgs/*.jpg too
+app.routes.insert(0, fh.Mount("/imgs", ImgFiles(directory="./imgs"), name="imgs"))
+app.routes.insert(0, fh.Mount("/js", bundles.BundleFiles(directory="./js"), name="js"))
+app.routes.insert(
+    0, fh.Mount("/css", compression.PrecompressedFiles(directory="./css"), name="css")
+)
 
 fh.setup_toasts(app)
 
 
+def validators(tag: str) -> dict:
+    """
+    Headers of a page revalidated with weak ETag tag. No Last-Modified, the
+    tag covers edits that have no timestamp.
+    """
+    return {
+        "ETag": f'W/"{tag}"',
+        "Cache-Control": const.REVALIDATE_CACHE,
+        "Vary": "HX-Request",
+    }
+
+
+def not_modified(req, headers: dict) -> fh.Response | None:
+    """
+    304 response if the client copy matches the ETag of headers. Copies
+    compressed by CompressionMiddleware have encoded ETags, the matching
+    one is sent back.
+    """
+    etag = headers["ETag"].removeprefix("W/")
+    for tag in req.headers.get("if-none-match", "").split(","):
+        tag = tag.strip()
+        if tag == "*" or compression.identity_etag(tag.removeprefix("W/")) == etag:
+            etag = headers["ETag"] if tag == "*" else tag
+            return fh.Response(status_code=304, headers={**headers, "ETag": etag})
+    return None
+
+
 @app.get("/cls_fltr/{div_id}")
 async def cls_fltr(d: dict, div_id: str = "dialog"):
     prefil = d.pop("city_id") if isinstance(d.get("city_id"), list) else None
@@ -138,6 +206,7 @@ async def get_register(sess):
 async def register(sess, user: dict):
     if not user.get("role"):
         user["role"] = s.Role.USER
+    s.set_name_norm(user)
     u = s.users.insert(user)
     if sess.get("auth_r"):
         fh.add_toast(sess, "User was registrered", "success")
@@ -221,7 +290,7 @@ async def get_comparisons(sess, req):
     data["user_id"] = data.get("user_id", sess["auth"])
     flds = ("select", "details", "address", "name")
     try:
-        tbl, locations = await c.get_cmp_for(data, flds, return_frm=True)
+        tbl, _ = await c.get_cmp_for(data, flds, return_frm=True)
     except ValueError:
         fh.add_toast(sess, "You don't have this type of comparisons yet", "error")
         return fh.Div(slctd, id="result")
@@ -230,7 +299,14 @@ async def get_comparisons(sess, req):
         (
             fh.Titled(
                 "Comparacao",
-                fh.Div(id="comparisons-map", cls="map"),
+                fh.Div(
+                    id="comparisons-map",
+                    cls="map",
+                    data_map="comparisons",
+                    data_query=urlencode(
+                        {k: data[k] for k in ("user_id", "ppt_type", "ad_type")}
+                    ),
+                ),
                 fh.Div(id="dialog"),
                 tbl,
                 fh.Grid(
@@ -241,16 +317,31 @@ async def get_comparisons(sess, req):
                     style="gap: 1.5rem",
                 ),
             ),
-            fh.Script(c.map_comparisons_script(locations)),
             *scripts,
         ),
         id="result",
     )
 
 
+@app.get("/comparisons/clusters")
+async def get_comparisons_clusters(sess, req):
+    """Clusters of the user comparisons for the zoom level as json."""
+    d = req.query_params
+    try:
+        qry, params = c.get_cmp_clusters_qry(
+            int(d.get("user_id") or sess["auth"]),
+            int(d["ppt_type"]),
+            int(d["ad_type"]),
+            int(d["zoom"]),
+        )
+    except (KeyError, ValueError):
+        return fh.JSONResponse({"error": "Wrong map params"}, status_code=400)
+    return fh.JSONResponse({"clusters": await aiodb.q(qry, params)})
+
+
 @app.get("/comparisons/{cmp_id}")
 async def get_comparisons(sess, req, cmp_id: int):
-    cmp = s.comparisons[cmp_id]
+    cmp = await aiodb.first("SELECT * FROM comparisons WHERE id = ?", (cmp_id,))
     return c.get_dialog(
         "Imovel",
         await c.get_ppt_infr_img_units(
@@ -266,20 +357,76 @@ async def download_pdf(sess, d: dict):
         if not isinstance(cmp_ids, list):
             cmp_ids = [cmp_ids]
             d["selected"] = cmp_ids
-    date = int(time.time())
-    # File path
-    output_pdf = f"./pdfs/{date}_dynamic_output.pdf"
-    await c.create_pdf(d, output_pdf)
-    task = BackgroundTask(c.delete_pdf, output_pdf)
+    filename = f"{const.PPT_TYPE[int(d['ppt_type'])]}_selection.pdf"
+    key = await c.get_pdf_key(d)
+    if path := pdf_cache.get(key):
+        return fh.FileResponse(
+            path,
+            media_type="application/pdf",
+            filename=filename,
+            content_disposition_type="attachment",
+        )
+    try:
+        job_id = pdf_jobs.submit(sess["auth"], filename, key, *await c.get_pdf_data(d))
+    except pdf_jobs.QueueFull:
+        return fh.Titled("PDF", fh.P("Too many PDFs are being created, try later"))
+    job = pdf_jobs.get(job_id, sess["auth"])
+    # small selections are ready in a moment, big ones are polled
+    if await pdf_jobs.wait(job, const.PDF_WAIT) and not job.future.exception():
+        return pdf_response(job_id, job)
+    return fh.Titled("PDF", pdf_job_status(job_id, job))
+
+
+def pdf_job_status(job_id: str, job):
+    if not job.future.done():
+        return fh.Div(
+            fh.P("Creating PDF..."),
+            fh.Progress(),
+            hx_get=f"/pdf_jobs/{job_id}",
+            hx_trigger="every 2s",
+            hx_swap="outerHTML",
+        )
+    if job.future.exception():
+        return fh.Div(fh.P("PDF creation failed"))
+    return fh.Div(fh.A("Download PDF", href=f"/pdf_jobs/{job_id}/download"))
+
+
+def pdf_response(job_id: str, job):
+    """Send pdf_cache file rendered by the job, the job is discarded afterwards."""
+    path = pdf_cache.get(job.key)
+    if path is None:  # evicted since
+        pdf_jobs.discard(job_id)
+        return fh.Response("PDF not found", status_code=404)
     return fh.FileResponse(
-        output_pdf,
+        path,
         media_type="application/pdf",
-        filename=f"{const.PPT_TYPE[int(d['ppt_type'])]}_selection.pdf",
+        filename=job.filename,
         content_disposition_type="attachment",
-        background=task,
+        background=BackgroundTask(pdf_jobs.discard, job_id),
     )
 
 
+@app.get("/pdf_jobs/{job_id}")
+def get_pdf_job(sess, job_id: str):
+    job = pdf_jobs.get(job_id, sess["auth"])
+    if job is None:
+        return fh.Div(fh.P("PDF not found"))
+    if job.future.done() and not job.future.exception():
+        return (
+            fh.HtmxResponseHeaders(redirect=f"/pdf_jobs/{job_id}/download"),
+            pdf_job_status(job_id, job),
+        )
+    return pdf_job_status(job_id, job)
+
+
+@app.get("/pdf_jobs/{job_id}/download")
+def download_pdf_job(sess, job_id: str):
+    job = pdf_jobs.get(job_id, sess["auth"])
+    if job is None or not job.future.done() or job.future.exception():
+        return fh.Response("PDF not found", status_code=404)
+    return pdf_response(job_id, job)
+
+
 @app.post("/archives")
 def add_archive(sess, d: dict):
     # Extract the values from the dict as a tuple of IDs
@@ -391,23 +538,21 @@ async def create_new_task(sess, d: dict):
 
 @app.route("/adrs", methods=["PUT", "POST"])
 async def create_adrs(sess, req, d: dict):
-    adrs_str = f"{d['cep']} {d['street_id']}, {d['str_number']}, "
-    f"{d['city_id']}, {d['region_id']}"
-    location = c.extract_lat_lng(adrs_str)
+    # location is filled in by the geocoding worker
     adrs_d = {
-        **{k: c.get_or_create(k, d[k]) for k in s.CDRS_FK if d.get(k)},
+        **{k: lookups.get_or_create(k, d[k]) for k in s.CDRS_FK if d.get(k)},
         **{k: v(d[k]) for k, v in s.CNB_FLDS.items() if d.get(k)},
-        "location": location,
     }
     text = "Endereço foi "
     if req.method == "PUT":
         adrs_d["id"] = d["id"]
         s.addresses.update(adrs_d)
+        await geocoding.enqueue(int(d["id"]))
         text += "editado"
         fh.add_toast(sess, text, "success")
         return None
     adrs = s.addresses.insert(adrs_d)
-    print(adrs)
+    await geocoding.enqueue(adrs["id"])
     text += "adicionado"
     frm = await c.get_ppt_frm(adrs["id"], int(d["ppt_type"]))
     fh.add_toast(sess, text, "success")
@@ -417,7 +562,7 @@ async def create_adrs(sess, req, d: dict):
 @app.route("/ppts", methods=["PUT", "POST"])
 async def create_ppt(sess, req, d: dict):
     if d.get("avcb_id"):
-        d["avcb_id"] = c.get_or_create("avcb_id", d["avcb_id"])
+        d["avcb_id"] = lookups.get_or_create("avcb_id", d["avcb_id"])
     for k in s.PPT_BOOL_FLDS:
         d[k] = bool(d.get(k))
     text = f'Propriedade {d["name"]} foi '
@@ -455,6 +600,60 @@ async def get_unit_form(sess, d: dict):
     )
 
 
+def get_map_types(d: dict) -> tuple[int, int]:
+    """ppt_type and ad_type of the map params, ValueError if unknown."""
+    ppt_type, ad_type = int(d["ppt_type"]), int(d["ad_type"])
+    if ppt_type not in s.PPT_TABLE_NAMES or ad_type not in const.AD_TYPE_FLDS:
+        raise ValueError(f"Unknown ppt_type {ppt_type} or ad_type {ad_type}")
+    return ppt_type, ad_type
+
+
+@app.get("/ppts/map")
+async def get_ppts_map(req):
+    """
+    Properties in the map viewport or in the radius (km) around lat, lng
+    as json. Paginated with ppt_id cursor.
+    """
+    d = c.get_query_dict(req)
+    bounds = near = None
+    try:
+        ppt_type, ad_type = get_map_types(d)
+        if d.get("radius"):
+            near = tuple(float(d[k]) for k in ("lat", "lng", "radius"))
+        else:
+            bounds = tuple(float(d[k]) for k in ("south", "west", "north", "east"))
+        limit = min(int(d.get("limit", const.MAP_LIMIT)), const.MAP_LIMIT)
+        cursor = int(d.get("cursor") or 0)
+    except (KeyError, ValueError):
+        return fh.JSONResponse({"error": "Wrong map params"}, status_code=400)
+    qry, params = c.get_ppts_qry(
+        d, ppt_type, ad_type, bounds=bounds, cursor=cursor, limit=limit, near=near
+    )
+    ppts = await aiodb.q(qry, params)
+    srcsets = await c.get_srcsets([ppt["id"] for ppt in ppts])
+    items = [c.ppt_serializer(ppt, srcsets) for ppt in ppts]
+    return fh.JSONResponse(
+        {
+            "items": items,
+            "cursor": items[-1]["id"] if len(items) == limit else None,
+        }
+    )
+
+
+@app.get("/ppts/clusters")
+async def get_ppts_clusters(req):
+    """Clusters of the properties in the map viewport for the zoom level as json."""
+    d = c.get_query_dict(req)
+    try:
+        ppt_type, ad_type = get_map_types(d)
+        zoom = int(d["zoom"])
+        bounds = tuple(float(d[k]) for k in ("south", "west", "north", "east"))
+    except (KeyError, ValueError):
+        return fh.JSONResponse({"error": "Wrong map params"}, status_code=400)
+    qry, params = c.get_clusters_qry(d, ppt_type, ad_type, zoom, bounds)
+    return fh.JSONResponse({"clusters": await aiodb.q(qry, params)})
+
+
 @app.get("/ppts/{ppt_id}")
 async def get_ppt(sess, req, ppt_id: int):
     ad_type = req.query_params.get("ad_type")
@@ -463,7 +662,9 @@ async def get_ppt(sess, req, ppt_id: int):
     if ad_type:
         ad_type = int(ad_type)
     if tsk_id:
-        tsk = s.tasks[int(tsk_id)]
+        tsk = await aiodb.first(
+            "SELECT client_id FROM tasks WHERE id = ?", (int(tsk_id),)
+        )
         usr_id = tsk["client_id"]
     flds = ["select"]  # extra flds for unit table
     btns = ["comparisons"]
@@ -471,7 +672,15 @@ async def get_ppt(sess, req, ppt_id: int):
         flds.append("edit")
     else:
         btns.append("visits")
-    return await c.get_ppt_infr_img_units(ppt_id, usr_id, flds, *btns, ad_type=ad_type)
+    # ppt_versions version covers all edits of the property and its units
+    version = await c.get_ppt_version(ppt_id)
+    page = "hx-request" not in req.headers and bundles.version
+    key = (ppt_id, version, usr_id, ad_type, flds, btns, page)
+    headers = validators(hashlib.sha256(repr(key).encode()).hexdigest()[:16])
+    if res := not_modified(req, headers):
+        return res
+    view = await c.get_ppt_infr_img_units(ppt_id, usr_id, flds, *btns, ad_type=ad_type)
+    return view, *(fh.HttpHeader(k, v) for k, v in headers.items())
 
 
 @app.get("/ppts/{ppt_id}/pdfs/{pdf_id}")
@@ -506,7 +715,7 @@ async def get_adrs_frm(sess, req, d: dict):
     LEFT JOIN addresses as a ON p.adrs_id = a.id
     WHERE p.ppt_type = ?{cnb_str}
     """
-    ppt = s.db.q(qry, (ppt_type, *cnb.values()))
+    ppt = await aiodb.q(qry, (ppt_type, *cnb.values()))
     if ppt:
         p = ppt[0]
         ppt_id = p["id"]
@@ -620,6 +829,7 @@ def get_tasks(sess):
 
 @app.put("/users")
 async def edit_user(user: s.USER):
+    s.set_name_norm(user)
     return s.users.update(user), cls_details()
 
 
@@ -660,6 +870,23 @@ async def get_ppts_fld(ppt_type: int):
     )
 
 
+@app.get("/autocomplete/{field}")
+async def get_autocomplete(sess, req, field: str):
+    """Top options of the field table whose name starts with the typed text."""
+    tbl = s.FK_TABLES.get(field)
+    if tbl is None or tbl.name not in s.NAME_NORM_TABLES:
+        return fh.Response(status_code=404)
+    # users are listed to employees only, lookup tables are open
+    if field in const.ROLE_FLDS and sess.get("auth_r") not in const.EMPLOYEES:
+        return fh.Response(status_code=403)
+    q = req.query_params.get("q", req.query_params.get(field, ""))
+    qry, params = c.get_autocomplete_qry(field, q)
+    return tuple(
+        fh.Li(option["name"], value=option["id"], cls="dropdown-item")
+        for option in await aiodb.q(qry, params)
+    )
+
+
 @app.get("/filters")
 async def get_filters(sess, req, ad_type: int, ppt_type: int):
     my_dict = {**req.query_params}
@@ -678,7 +905,7 @@ async def get_filters(sess, req, ad_type: int, ppt_type: int):
 @app.get("/ppts")
 async def get_ppts(sess, req):
     role = sess.get("auth_r", const.ANONIM)
-    d = {**req.query_params}
+    d = c.get_query_dict(req)
     if d:
         ppt_type = int(d["ppt_type"])
         ad_type = int(d["ad_type"])
@@ -692,8 +919,10 @@ async def get_ppts(sess, req):
                 if action == "save":
                     await c.save_task_params(d)
                 elif action == "add_params":
-                    tbl = s.PPT_TSK_TABLES[ppt_type]
-                    tsk_params = list(tbl.rows_where("task_id = ?", (int(tsk_id),)))[0]
+                    tbl = s.PPT_TSK_TABLES[ppt_type].name
+                    tsk_params = await aiodb.first(
+                        f"SELECT * FROM {tbl} WHERE task_id = ?", (int(tsk_id),)
+                    )
                     price_fld = const.AD_TYPE_FLDS[ad_type]
                     qry = """
                     SELECT c.name
@@ -701,7 +930,9 @@ async def get_ppts(sess, req):
                     LEFT JOIN cities as c ON tc.city_id = c.id
                     WHERE task_id = ?
                     """
-                    d["city_id"] = list(k["name"] for k in s.db.q(qry, (int(tsk_id),)))
+                    d["city_id"] = list(
+                        k["name"] for k in await aiodb.q(qry, (int(tsk_id),))
+                    )
                     for k in const.MIN_MAX:
                         tsk_params[f"{price_fld}_{k}"] = tsk_params[f"price_{k}"]
                     for k, v in tsk_params.items():
@@ -728,7 +959,9 @@ async def get_ppts(sess, req):
                         hx_swap_oob="true",
                     )
                 if tsk_id:
-                    tsk = s.tasks[tsk_id]
+                    tsk = await aiodb.first(
+                        "SELECT client_id FROM tasks WHERE id = ?", (int(tsk_id),)
+                    )
                     return await c.get_ppt_infr_img_units(
                         ppt_id,
                         tsk["client_id"],
@@ -739,35 +972,31 @@ async def get_ppts(sess, req):
                 return await c.get_ppt_infr_img_units(
                     ppt_id, int(sess["auth"]), ["edit"], ad_type=ad_type
                 )
-        unit_tbl = s.PPT_TABLE_NAMES.get(ppt_type)
-        qry = f"""
-        SELECT p.id, a.location, p.ppt_type, p.name,
-        c.name AS city, s.name AS street,
-        GROUP_CONCAT(DISTINCT pi.name) AS images,
-        SUM(area) as max_area,
-        MIN(area) as min_area,
-        MIN({const.AD_TYPE_FLDS[ad_type]}) as price
-        FROM addresses AS a
-        LEFT JOIN cities AS c ON a.city_id = c.id
-        LEFT JOIN streets AS s ON a.street_id = s.id
-        LEFT JOIN properties AS p ON a.id = p.adrs_id
-        LEFT JOIN ppt_images AS pi ON p.id = pi.ppt_id
-        LEFT JOIN {unit_tbl} AS m ON p.id = m.ppt_id
-        GROUP BY p.id
-        """
-        ppts = s.db.q(qry)
-        if ppts:
-            locations = [c.ppt_serializer(ppt) for ppt in ppts]
+        qry, params = c.get_ppts_qry(d, ppt_type, ad_type, limit=1)
+        if await aiodb.q(qry, params):
+            fltr = urlencode(
+                {k: v for k, v in d.items() if v and not k.endswith("_handler")},
+                doseq=True,
+            )
             prefil = d.pop("city_id") if isinstance(d.get("city_id"), list) else None
             frm = await c.short_fltr(ad_type, ppt_type, prefil=prefil)
             frm = fh.fill_form(frm, d)
             return (
                 fh.Div(
                     frm,
-                    fh.Grid(fh.Ul(id="location-list"), fh.Div(id="map", cls="map")),
+                    fh.Grid(
+                        fh.Ul(id="location-list"),
+                        fh.Div(
+                            id="map",
+                            cls="map",
+                            data_map="locations",
+                            data_fltr=fltr,
+                            data_query=query,
+                            data_cluster_max_zoom=s.CLUSTER_MAX_ZOOM,
+                        ),
+                    ),
                     id="result",
                 ),
-                fh.Script(c.map_locations_script(locations, query)),
                 cls_details(),
             )
         else:
@@ -814,9 +1043,9 @@ async def edit_property(sess, ppt_id: int):
         fh.Div(
             frm_adrs,
             frm_ppt,
-            c.get_block_for("pdfs", ppt_id),
-            c.get_block_for("infrs", ppt_id),
-            c.get_block_for("imgs", ppt_id),
+            await c.get_block_for("pdfs", ppt_id),
+            await c.get_block_for("infrs", ppt_id),
+            await c.get_block_for("imgs", ppt_id),
         ),
         z_index=1000,
     )
@@ -856,12 +1085,13 @@ async def edit_unit(sess, req, ppt_id: int, unit: dict):
     for k in bool_flds:
         u[k] = bool(u.get(k))
 
+    # last_update also invalidates cached comparison pdfs with the unit
+    u["last_update"] = int(time.time())
     if req.method == "PUT":
         tbl.update(u)
         text += "editada"
     else:
         action = u.pop("action")
-        u["last_update"] = int(time.time())
         u["status"] = s.Status.ACTIVE
         tbl.insert(u)
         text += "adicionada"
@@ -886,15 +1116,24 @@ async def get_imgs(ppt_id: int):
 
 
 @app.post("/{ppt_id}/{path}")
-async def create_item(ppt_id: int, path: str, d: dict):
+async def create_item(sess, ppt_id: int, path: str, d: dict):
     items = list()
     fls = d[path]
     if fls:
         if not isinstance(fls, list):
             fls = (fls,)
-        for itm in fls:
-            i = await c.save_item(path, ppt_id, itm)
-            items.append(c.show_item(path, ppt_id, i))
+        saved = await asyncio.gather(
+            *(c.save_item(path, ppt_id, itm) for itm in fls), return_exceptions=True
+        )
+        for itm, i in zip(fls, saved):
+            if isinstance(i, c.UploadTooLarge):
+                fh.add_toast(sess, f"{itm.filename} is too big", "error")
+            elif isinstance(i, BaseException):
+                raise i
+            elif i is None:
+                fh.add_toast(sess, f"{itm.filename} is already added", "info")
+            else:
+                items.append(c.show_item(path, ppt_id, i))
     inp_prms = dict(id=f"new_{path}", name=path, hx_swap_oob="true")
     if path != "infrs":
         inp_prms.update(type="file", multiple=True)
@@ -909,7 +1148,7 @@ async def delete_item(ppt_id: int, item_id: int, path: str):
             "infr_id = ? and ppt_id = ?", (item_id, ppt_id)
         )
     else:
-        c.delete_file(path, item_id)
+        await c.delete_file(path, item_id)
     return cls_details(f"{path}-{item_id}")
 
 
@@ -918,6 +1157,7 @@ def get_infr_frm(ppt_id: int, infr_id: int):
     div_id = const.INFR_EDIT
     res = fh.Form(
         fh.Hidden(id="id"),
+        fh.Hidden(name="ppt_id", value=ppt_id),
         fh.Input(id="name"),
         fh.Button("Save"),
         hx_put="/infrs",
@@ -939,9 +1179,16 @@ def get_infr_frm(ppt_id: int, infr_id: int):
 
 
 @app.put("/infrs")
-def edit_infr(infr: dict):
-    s.infrastructures.update(infr)
-    return c.show_item("infrs", infr["ppt_id"], infr), cls_details(const.INFR_EDIT)
+def edit_infr(sess, infr: dict):
+    ppt_id = int(infr.pop("ppt_id"))
+    s.set_name_norm(infr)
+    try:
+        s.infrastructures.update(infr)
+    except sqlite3.IntegrityError:
+        fh.add_toast(sess, "Infrastructure with this name already exists", "error")
+        infr = {**infr, "name": s.infrastructures[infr["id"]]["name"]}
+    lookups.invalidate("infr_id")
+    return c.show_item("infrs", ppt_id, infr), cls_details(const.INFR_EDIT)
 
 
 async def get_employee_view(sess):
@@ -1010,27 +1257,43 @@ scripts = (
         src=f"https://maps.googleapis.com/maps/api/js?key={s.GOOGLE_API}&callback=initMap&v=3&libraries=marker",
         defer=True,
     ),
-    fh.Script(src="https://unpkg.com/@googlemaps/markerclusterer/dist/index.min.js"),
 )
 
-from fastcore.xtras import timed_cache
+# Rendered header, body and footer of the home page by role, the body of
+# employees has their tasks and is not cached. They depend on the role only,
+# the version is the footer year.
+_shells = cache.FragmentCache(maxsize=8)
 
 
-@timed_cache(seconds=60)
-async def home(sess):
+async def get_shell(sess) -> tuple[str, str | None, str]:
     role = sess.get("auth_r", const.ANONIM)
-    body_section = (
-        get_user_view if role in (s.Role.USER, const.ANONIM) else get_employee_view
-    )
+    version = dt.now().year
+    shell = _shells.get(role, version)
+    if shell is None:
+        body = None
+        if role in (s.Role.USER, const.ANONIM):
+            body = fh.to_xml(await get_user_view(sess))
+        shell = (
+            fh.to_xml(await header_section(sess)),
+            body,
+            fh.to_xml(await footer_section()),
+        )
+        _shells.put(role, version, shell)
+    return shell
+
+
+async def home(sess):
+    header, body, footer = await get_shell(sess)
     return (
         fh.Title(f"Retha - {const.DESCR}"),
         *scripts,
         # fh.Div(id='sidebar'),
         fh.Main(
-            await header_section(sess),
-            await body_section(sess),
+            fh.NotStr(header),
+            fh.NotStr(body) if body else await get_employee_view(sess),
             fh.Div(id="dialog"),
             fh.Div(id="register"),
+            fh.NotStr(footer),
         ),
     )
 
@@ -1040,4 +1303,7 @@ async def homepage(sess):
     return await home(sess)
 
 
-fh.serve()
+if __name__ == "__main__":
+    # development server, started with uvicorn main:app pdf workers do not
+    # import this module, see README
+    fh.serve()
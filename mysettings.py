@@ -1,22 +1,60 @@
 import os
+import unicodedata
 from pathlib import Path
 
 import fasthtml.common as fh
-import googlemaps
+from const import AdType, Choice, PropertyType, Role, Status
 from dotenv import load_dotenv
 
 load_dotenv()
 
 GOOGLE_API = os.getenv("GOOGLE_API")
-gmaps = googlemaps.Client(key=GOOGLE_API)
 
 
 BASE_DIR = Path(__file__).resolve().parent
 IMG_DIR = BASE_DIR / "imgs"
 PDF_DIR = BASE_DIR / "pdfs"
+CSS_DIR = BASE_DIR / "css"
+JS_DIR = BASE_DIR / "js"
+STATIC_CACHE_DIR = BASE_DIR / "cache" / "static"  # precompressed css and js
+GEOCODE_CURSOR_FILE = BASE_DIR / "cache" / "geocode_cursor"  # python geocoding.py
 DEFAULT_IMG = "/imgs/default_image.jpg"
 
-db = fh.database("data/test.db")
+DB_PATH = "data/test.db"
+DB_POOL_SIZE = 8  # threads for async queries, see aiodb.py
+DB_BUSY_TIMEOUT = 5.0  # seconds to wait for a locked database
+
+
+def normalize_name(name: str | None) -> str | None:
+    """Casefolded name without accents, 'São Paulo' -> 'sao paulo'."""
+    if name is None:
+        return None
+    name = unicodedata.normalize("NFKD", str(name).strip())
+    return "".join(ch for ch in name if not unicodedata.combining(ch)).casefold()
+
+
+def set_name_norm(row) -> None:
+    """
+    Set name_norm of a NAME_NORM_TABLES row, dict or dataclass, from its
+    name. Call before every insert or update of the name.
+    """
+    if isinstance(row, dict):
+        if "name" in row:
+            row["name_norm"] = normalize_name(row["name"])
+    elif getattr(row, "name", None) is not None:
+        row.name_norm = normalize_name(row.name)
+
+
+def register_functions(conn):
+    """SQL functions used by migrations, not available to other connections."""
+    conn.create_function("normalize_name", 1, normalize_name, deterministic=True)
+
+
+db = fh.database(DB_PATH)
+register_functions(db.conn)
+# WAL lets pool readers run concurrently with the writer
+db.execute("PRAGMA journal_mode = WAL")
+db.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT * 1000)}")
 
 addresses = db.t.addresses
 properties = db.t.properties
@@ -53,40 +91,6 @@ covers = db.t.covers
 ppt_pdfs = db.t.ppt_pdfs
 
 
-class Choice:
-    YES = 1
-    NO = 2
-    BOTH = 3
-
-
-class Role:
-    ADMIN = 1
-    USER = 2
-    BROKER = 3
-    OWNER = 4
-    SECRETARY = 5
-
-
-class AdType:
-    RENT = 1
-    SELL = 2
-
-
-class Status:
-    ACTIVE = 1
-    ARCHIVE = 2
-    NEW = 3
-    SUSPENDED = 4
-    SUCCESS = 5
-
-
-class PropertyType:
-    WAREHOUSE = 1
-    LAND = 2
-    OFFICE = 3
-    SHOP = 4
-
-
 DATE_FLDS = (
     "start_date",
     "last_update",
@@ -112,6 +116,13 @@ CDRS_FK = {
     "street_id": streets,
 }
 
+# Tables of names referenced by id, cached in lookups.py
+LOOKUP_FK = {
+    **CDRS_FK,
+    "avcb_id": avcbs,
+    "infr_id": infrastructures,
+}
+
 USR_DFLT_FLDS = {
     "name": str,
     "email": str,
@@ -593,7 +604,635 @@ def _initialize_db():
         )
 
 
-_initialize_db()
+def _add_indexes():
+    """Indexes for join and filter columns of existing databases."""
+    for tbl in (warehouses, lands, offices, shops):
+        tbl.create_index(["ppt_id", "status"], if_not_exists=True)
+        tbl.create_index(["status"], if_not_exists=True)
+    comparisons.create_index(["user_id", "ad_type", "status"], if_not_exists=True)
+    for tbl in (
+        warehouse_comparisons,
+        land_comparisons,
+        office_comparisons,
+        shop_comparisons,
+    ):
+        tbl.create_index(["comparison_id"], if_not_exists=True)
+    tasks.create_index(["broker_id", "status"], if_not_exists=True)
+    for tbl in (
+        notes,
+        task_cities,
+        task_regions,
+        task_districts,
+        task_infrastructures,
+        task_avcbs,
+        warehouse_tasks,
+        land_tasks,
+        shop_tasks,
+        office_tasks,
+    ):
+        tbl.create_index(["task_id"], if_not_exists=True)
+    addresses.create_index(["cep", "str_number", "block"], if_not_exists=True)
+    addresses.create_index(["city_id"], if_not_exists=True)
+    properties.create_index(["adrs_id"], if_not_exists=True)
+    properties.create_index(["ppt_type"], if_not_exists=True)
+    ppt_infrastructures.create_index(["infr_id"], if_not_exists=True)
+    db.execute("ANALYZE")
+
+
+ppt_search = db.t.ppt_search
+
+PPT_SEARCH_FLDS = (
+    "ppt_id",
+    "ad_type",
+    "ppt_type",
+    "name",
+    "adrs_id",
+    "city_id",
+    "region_id",
+    "district_id",
+    "avcb_id",
+    "in_conodminium",
+    "under_construction",
+    "location",
+    "lat",
+    "lng",
+    "city",
+    "street",
+    "images",
+    "min_area",
+    "max_area",
+    "price",
+    "units",
+)
+
+
+# Coordinate of a location json, NULL if the location is NULL or invalid
+_location_coord = "CASE WHEN json_valid({loc}) THEN json_extract({loc}, '$.{k}') END"
+
+
+def _ppt_search_select(ppt_type: int, where: str = "") -> str:
+    """
+    Select rows of ppt_search for properties of ppt_type. One row per
+    (property, ad_type) with active units only.
+    """
+    unit_tbl = PPT_TABLE_NAMES[ppt_type]
+    return f"""
+    SELECT p.id, t.ad_type, p.ppt_type, p.name, p.adrs_id,
+    a.city_id, a.region_id, a.district_id, p.avcb_id,
+    p.in_conodminium, p.under_construction,
+    a.location,
+    {_location_coord.format(loc="a.location", k="lat")},
+    {_location_coord.format(loc="a.location", k="lng")},
+    c.name, s.name,
+    (
+        SELECT GROUP_CONCAT(name) FROM (
+            SELECT name FROM ppt_images WHERE ppt_id = p.id ORDER BY cover DESC, id
+        )
+    ),
+    MIN(m.area), SUM(m.area),
+    MIN(CASE t.ad_type WHEN {AdType.RENT} THEN m.rent ELSE m.sell END),
+    COUNT(m.id)
+    FROM properties AS p
+    JOIN {unit_tbl} AS m ON m.ppt_id = p.id AND m.status = {Status.ACTIVE}
+    JOIN (SELECT {AdType.RENT} AS ad_type UNION ALL SELECT {AdType.SELL}) AS t
+    LEFT JOIN addresses AS a ON p.adrs_id = a.id
+    LEFT JOIN cities AS c ON a.city_id = c.id
+    LEFT JOIN streets AS s ON a.street_id = s.id
+    WHERE p.ppt_type = {ppt_type} {where}
+    GROUP BY p.id, t.ad_type
+    """
+
+
+def _ppt_search_refresh(cond: str, ppt_types=tuple(PPT_TABLE_NAMES)) -> str:
+    """
+    Trigger statements rebuilding ppt_search rows of properties which ids
+    match cond, e.g. `= NEW.ppt_id`.
+    """
+    flds = ", ".join(PPT_SEARCH_FLDS)
+    stmts = [f"DELETE FROM ppt_search WHERE ppt_id {cond};"]
+    stmts += [
+        f"INSERT INTO ppt_search ({flds}) "
+        f"{_ppt_search_select(k, f'AND p.id {cond}')};"
+        for k in ppt_types
+    ]
+    return "\n".join(stmts)
+
+
+def _create_ppt_search_triggers():
+    triggers = {}
+    for ppt_type, unit_tbl in PPT_TABLE_NAMES.items():
+        refresh_new = _ppt_search_refresh("= NEW.ppt_id", (ppt_type,))
+        refresh_old = _ppt_search_refresh("= OLD.ppt_id", (ppt_type,))
+        triggers[f"{unit_tbl}_ai"] = (
+            f"AFTER INSERT ON {unit_tbl} BEGIN {refresh_new} END"
+        )
+        triggers[f"{unit_tbl}_ad"] = (
+            f"AFTER DELETE ON {unit_tbl} BEGIN {refresh_old} END"
+        )
+        triggers[f"{unit_tbl}_au"] = (
+            f"AFTER UPDATE ON {unit_tbl} BEGIN {refresh_old} {refresh_new} END"
+        )
+    for k in ("ai", "au"):
+        event = {"ai": "INSERT", "au": "UPDATE"}[k]
+        triggers[f"ppt_images_{k}"] = (
+            f"AFTER {event} ON ppt_images BEGIN "
+            f"{_ppt_search_refresh('= NEW.ppt_id')} END"
+        )
+    triggers["ppt_images_ad"] = (
+        f"AFTER DELETE ON ppt_images BEGIN {_ppt_search_refresh('= OLD.ppt_id')} END"
+    )
+    triggers["properties_au"] = (
+        f"AFTER UPDATE ON properties BEGIN {_ppt_search_refresh('= NEW.id')} END"
+    )
+    triggers["properties_ad"] = (
+        "AFTER DELETE ON properties BEGIN "
+        "DELETE FROM ppt_search WHERE ppt_id = OLD.id; END"
+    )
+    adrs_ppts = "IN (SELECT id FROM properties WHERE adrs_id = NEW.id)"
+    triggers["addresses_au"] = (
+        f"AFTER UPDATE ON addresses BEGIN {_ppt_search_refresh(adrs_ppts)} END"
+    )
+    for name, body in triggers.items():
+        db.execute(f"DROP TRIGGER IF EXISTS ppt_search_{name}")
+        db.execute(f"CREATE TRIGGER ppt_search_{name} {body}")
+
+
+def _create_ppt_search():
+    """Denormalized search table maintained by triggers."""
+    ppt_search.create(
+        ppt_id=int,
+        ad_type=int,
+        ppt_type=int,
+        name=str,
+        adrs_id=int,
+        city_id=int,
+        region_id=int,
+        district_id=int,
+        avcb_id=int,
+        in_conodminium=bool,
+        under_construction=bool,
+        location=str,
+        lat=float,
+        lng=float,
+        city=str,
+        street=str,
+        images=str,
+        min_area=int,
+        max_area=int,
+        price=int,
+        units=int,
+        pk=("ppt_id", "ad_type"),
+        if_not_exists=True,
+    )
+    ppt_search.create_index(["ppt_type", "ad_type"], if_not_exists=True)
+    _create_ppt_search_triggers()
+    flds = ", ".join(PPT_SEARCH_FLDS)
+    with db.conn:
+        db.execute("DELETE FROM ppt_search")
+        for ppt_type in PPT_TABLE_NAMES:
+            db.execute(
+                f"INSERT INTO ppt_search ({flds}) {_ppt_search_select(ppt_type)}"
+            )
+
+
+def _add_ppt_search_location_index():
+    ppt_search.create_index(["ppt_type", "ad_type", "lat", "lng"], if_not_exists=True)
+
+
+addresses_rtree = db.t.addresses_rtree
+
+
+def _add_address_coordinates():
+    """
+    Numeric lat/lng of addresses and R*Tree index over them.
+    Both are derived from addresses.location by triggers.
+    """
+    for k in ("lat", "lng"):
+        if k not in addresses.columns_dict:
+            addresses.add_column(k, float)
+    db.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS addresses_rtree "
+        "USING rtree(id, min_lat, max_lat, min_lng, max_lng)"
+    )
+    set_lat_lng = """
+    UPDATE addresses SET
+    lat = json_extract(NEW.location, '$.lat'),
+    lng = json_extract(NEW.location, '$.lng')
+    WHERE id = NEW.id AND json_valid(NEW.location);
+    """
+    set_rtree = """
+    DELETE FROM addresses_rtree WHERE id = NEW.id;
+    INSERT INTO addresses_rtree
+    SELECT NEW.id, NEW.lat, NEW.lat, NEW.lng, NEW.lng
+    WHERE NEW.lat IS NOT NULL AND NEW.lng IS NOT NULL;
+    """
+    triggers = {
+        "location_ai": f"AFTER INSERT ON addresses BEGIN {set_lat_lng} END",
+        "location_au": f"AFTER UPDATE OF location ON addresses BEGIN {set_lat_lng} END",
+        "rtree_au": f"AFTER UPDATE OF lat, lng ON addresses BEGIN {set_rtree} END",
+        "rtree_ad": (
+            "AFTER DELETE ON addresses BEGIN "
+            "DELETE FROM addresses_rtree WHERE id = OLD.id; END"
+        ),
+    }
+    for name, body in triggers.items():
+        db.execute(f"DROP TRIGGER IF EXISTS addresses_{name}")
+        db.execute(f"CREATE TRIGGER addresses_{name} {body}")
+    ppt_search.create_index(["adrs_id", "ppt_type", "ad_type"], if_not_exists=True)
+    # rtree rows are inserted by addresses_rtree_au trigger
+    with db.conn:
+        db.execute("""
+            UPDATE addresses SET
+            lat = json_extract(location, '$.lat'),
+            lng = json_extract(location, '$.lng')
+            WHERE json_valid(location)
+            """)
+
+
+cluster_zooms = db.t.cluster_zooms
+ppt_clusters = db.t.ppt_clusters
+
+# Map clusters are precomputed for zoom levels 0..CLUSTER_MAX_ZOOM,
+# grid cell is a 1 / CLUSTER_CELLS_PER_TILE part of the map tile.
+# Stored in cluster_zooms, so changing them requires a new migration.
+CLUSTER_MAX_ZOOM = 14
+CLUSTER_CELLS_PER_TILE = 4
+
+
+def _create_ppt_clusters():
+    """Grid clusters of ppt_search rows per zoom, maintained by triggers."""
+    cluster_zooms.create(zoom=int, cell=float, pk="zoom", if_not_exists=True)
+    cluster_zooms.upsert_all(
+        [
+            {"zoom": z, "cell": 360 / 2**z / CLUSTER_CELLS_PER_TILE}
+            for z in range(CLUSTER_MAX_ZOOM + 1)
+        ],
+        pk="zoom",
+    )
+    ppt_clusters.create(
+        ppt_type=int,
+        ad_type=int,
+        zoom=int,
+        cx=int,
+        cy=int,
+        n=int,
+        lat_sum=float,
+        lng_sum=float,
+        min_price=int,
+        pk=("ppt_type", "ad_type", "zoom", "cx", "cy"),
+        if_not_exists=True,
+    )
+    # lat + 90 and lng + 180 are positive, so CAST works as floor
+    cell = """
+    CAST(({row}.lng + 180) / z.cell AS INTEGER),
+    CAST(({row}.lat + 90) / z.cell AS INTEGER)
+    """
+    add = f"""
+    INSERT INTO ppt_clusters
+    SELECT NEW.ppt_type, NEW.ad_type, z.zoom, {cell.format(row="NEW")},
+    1, NEW.lat, NEW.lng, NEW.price
+    FROM cluster_zooms AS z
+    WHERE NEW.lat IS NOT NULL AND NEW.lng IS NOT NULL
+    ON CONFLICT DO UPDATE SET
+    n = n + 1,
+    lat_sum = lat_sum + excluded.lat_sum,
+    lng_sum = lng_sum + excluded.lng_sum,
+    min_price = MIN(
+        COALESCE(min_price, excluded.min_price),
+        COALESCE(excluded.min_price, min_price)
+    );
+    """
+    # min price is recalculated from ppt_search only when the removed row
+    # could hold it, the cell is found by (ppt_type, ad_type, lat, lng) index
+    remove = f"""
+    UPDATE ppt_clusters SET
+    n = n - 1,
+    lat_sum = lat_sum - OLD.lat,
+    lng_sum = lng_sum - OLD.lng,
+    min_price = CASE WHEN OLD.price > min_price THEN min_price ELSE (
+        SELECT MIN(ps.price) FROM ppt_search AS ps, cluster_zooms AS z
+        WHERE z.zoom = ppt_clusters.zoom
+        AND ps.ppt_type = OLD.ppt_type AND ps.ad_type = OLD.ad_type
+        AND ps.lat >= ppt_clusters.cy * z.cell - 90
+        AND ps.lat < (ppt_clusters.cy + 1) * z.cell - 90
+        AND ps.lng >= ppt_clusters.cx * z.cell - 180
+        AND ps.lng < (ppt_clusters.cx + 1) * z.cell - 180
+    ) END
+    WHERE (ppt_type, ad_type, zoom, cx, cy) IN (
+        SELECT OLD.ppt_type, OLD.ad_type, z.zoom, {cell.format(row="OLD")}
+        FROM cluster_zooms AS z
+        WHERE OLD.lat IS NOT NULL AND OLD.lng IS NOT NULL
+    );
+    DELETE FROM ppt_clusters WHERE n <= 0;
+    """
+    triggers = {
+        "ai": f"AFTER INSERT ON ppt_search BEGIN {add} END",
+        "ad": f"AFTER DELETE ON ppt_search BEGIN {remove} END",
+        "au": f"AFTER UPDATE ON ppt_search BEGIN {remove} {add} END",
+    }
+    for name, body in triggers.items():
+        db.execute(f"DROP TRIGGER IF EXISTS ppt_clusters_{name}")
+        db.execute(f"CREATE TRIGGER ppt_clusters_{name} {body}")
+    with db.conn:
+        db.execute("DELETE FROM ppt_clusters")
+        db.execute(f"""
+            INSERT INTO ppt_clusters
+            SELECT ps.ppt_type, ps.ad_type, z.zoom, {cell.format(row="ps")},
+            COUNT(*), SUM(ps.lat), SUM(ps.lng), MIN(ps.price)
+            FROM ppt_search AS ps, cluster_zooms AS z
+            WHERE ps.lat IS NOT NULL AND ps.lng IS NOT NULL
+            GROUP BY 1, 2, 3, 4, 5
+            """)
+
+
+# Lookup tables searched by name prefix, see /autocomplete
+NAME_NORM_TABLES = (
+    "cities",
+    "regions",
+    "districts",
+    "streets",
+    "avcbs",
+    "infrastructures",
+    "users",
+)
+
+
+def _add_name_norm():
+    """Indexed normalize_name(name) column for prefix search, set by triggers."""
+    set_name_norm = (
+        "BEGIN UPDATE {tbl} SET name_norm = normalize_name(NEW.name) "
+        "WHERE id = NEW.id; END"
+    )
+    for name in NAME_NORM_TABLES:
+        tbl = db.t[name]
+        if "name_norm" not in tbl.columns_dict:
+            tbl.add_column("name_norm", str)
+        for trg, event in (("ai", "INSERT"), ("au", "UPDATE OF name")):
+            db.execute(f"DROP TRIGGER IF EXISTS {name}_name_norm_{trg}")
+            db.execute(
+                f"CREATE TRIGGER {name}_name_norm_{trg} AFTER {event} ON {name} "
+                + set_name_norm.format(tbl=name)
+            )
+        # users are searched inside one role
+        cols = ["role", "name_norm"] if name == "users" else ["name_norm"]
+        tbl.create_index(cols, if_not_exists=True)
+        with db.conn:
+            db.execute(f"UPDATE {name} SET name_norm = normalize_name(name)")
+
+
+def _add_unique_name_norm():
+    """
+    Unique name_norm of LOOKUP_FK tables. name_norm of duplicates is set
+    to NULL, so the oldest row keeps the name and references stay valid.
+    """
+    for tbl in LOOKUP_FK.values():
+        with db.conn:
+            db.execute(f"""
+                UPDATE {tbl.name} SET name_norm = NULL WHERE id NOT IN (
+                    SELECT MIN(id) FROM {tbl.name} GROUP BY name_norm
+                )
+                """)
+            db.execute(f"DROP INDEX IF EXISTS idx_{tbl.name}_name_norm")
+        tbl.create_index(["name_norm"], unique=True)
+
+
+ppt_versions = db.t.ppt_versions
+
+
+_ppt_versions_bump = """
+INSERT INTO ppt_versions (ppt_id, version)
+SELECT id, 1 FROM properties WHERE id {cond}
+ON CONFLICT (ppt_id) DO UPDATE SET version = version + 1;
+"""
+
+
+def _create_ppt_versions():
+    """
+    Version of property data shown in comparison pdfs, bumped by triggers
+    on the property, its images, infrastructures and address names.
+    Units have their own last_update.
+    """
+    ppt_versions.create(ppt_id=int, version=int, pk="ppt_id", if_not_exists=True)
+    adrs_ppts = "IN (SELECT id FROM properties WHERE adrs_id {cond})"
+    triggers = {
+        "properties_au": ("AFTER UPDATE ON properties", "= NEW.id"),
+        "ppt_images_ai": ("AFTER INSERT ON ppt_images", "= NEW.ppt_id"),
+        "ppt_images_au": ("AFTER UPDATE ON ppt_images", "= NEW.ppt_id"),
+        "ppt_images_ad": ("AFTER DELETE ON ppt_images", "= OLD.ppt_id"),
+        "ppt_infrastructures_ai": (
+            "AFTER INSERT ON ppt_infrastructures",
+            "= NEW.ppt_id",
+        ),
+        "ppt_infrastructures_ad": (
+            "AFTER DELETE ON ppt_infrastructures",
+            "= OLD.ppt_id",
+        ),
+        "infrastructures_au": (
+            "AFTER UPDATE OF name ON infrastructures",
+            "IN (SELECT ppt_id FROM ppt_infrastructures WHERE infr_id = NEW.id)",
+        ),
+        "addresses_au": (
+            "AFTER UPDATE ON addresses",
+            adrs_ppts.format(cond="= NEW.id"),
+        ),
+    }
+    for tbl, fk in (("cities", "city_id"), ("districts", "district_id")):
+        triggers[f"{tbl}_au"] = (
+            f"AFTER UPDATE OF name ON {tbl}",
+            adrs_ppts.format(cond=f"IN (SELECT id FROM addresses WHERE {fk} = NEW.id)"),
+        )
+    for name, (event, cond) in triggers.items():
+        db.execute(f"DROP TRIGGER IF EXISTS ppt_versions_{name}")
+        db.execute(
+            f"CREATE TRIGGER ppt_versions_{name} {event} "
+            f"BEGIN {_ppt_versions_bump.format(cond=cond)} END"
+        )
+
+
+ppt_image_variants = db.t.ppt_image_variants
+
+
+def _create_ppt_image_variants():
+    """Resized copies of ppt_images, removed with the image row."""
+    ppt_image_variants.create(
+        image_id=int,
+        variant=str,
+        name=str,
+        width=int,
+        height=int,
+        pk=("image_id", "variant"),
+        foreign_keys=[("image_id", "ppt_images", "id")],
+        if_not_exists=True,
+    )
+    db.execute("DROP TRIGGER IF EXISTS ppt_image_variants_ad")
+    db.execute(
+        "CREATE TRIGGER ppt_image_variants_ad AFTER DELETE ON ppt_images BEGIN "
+        "DELETE FROM ppt_image_variants WHERE image_id = OLD.id; END"
+    )
+
+
+def _add_file_checksums():
+    """sha256 of uploaded files, NULL for files uploaded before."""
+    for tbl in (ppt_images, ppt_pdfs):
+        if "sha256" not in tbl.columns_dict:
+            tbl.add_column("sha256", str)
+
+
+def _add_ppt_images_name_index():
+    """ppt_images rows by the photo file, counted as blob references."""
+    ppt_images.create_index(["name"], if_not_exists=True)
+
+
+geocodes = db.t.geocodes
+
+
+def _create_geocodes():
+    """Geocoder results by geocoding.get_key of the address, NULL if not found."""
+    geocodes.create(key=str, location=str, expires=int, pk="key", if_not_exists=True)
+
+
+geocode_queue = db.t.geocode_queue
+
+
+def _create_geocode_queue():
+    """Addresses waiting for geocoding.py worker, next_try is a unix time."""
+    geocode_queue.create(
+        adrs_id=int,
+        attempts=int,
+        next_try=float,
+        queued=float,
+        pk="adrs_id",
+        foreign_keys=[("adrs_id", "addresses", "id")],
+        if_not_exists=True,
+    )
+    geocode_queue.create_index(["next_try"], if_not_exists=True)
+
+
+def _add_address_geocoded():
+    """Unix time of the last geocoding of the address."""
+    if "geocoded" not in addresses.columns_dict:
+        addresses.add_column("geocoded", int)
+
+
+def _add_ppt_versions_triggers():
+    """
+    Bump ppt_versions on unit edits, photo variants and street renames too,
+    it is the version of cached property views as well.
+    """
+    triggers = {
+        "ppt_image_variants_ai": (
+            "AFTER INSERT ON ppt_image_variants",
+            "= (SELECT ppt_id FROM ppt_images WHERE id = NEW.image_id)",
+        ),
+        "streets_au": (
+            "AFTER UPDATE OF name ON streets",
+            "IN (SELECT id FROM properties WHERE adrs_id IN "
+            "(SELECT id FROM addresses WHERE street_id = NEW.id))",
+        ),
+    }
+    for unit_tbl in PPT_TABLE_NAMES.values():
+        triggers[f"{unit_tbl}_ai"] = (f"AFTER INSERT ON {unit_tbl}", "= NEW.ppt_id")
+        triggers[f"{unit_tbl}_au"] = (f"AFTER UPDATE ON {unit_tbl}", "= NEW.ppt_id")
+        triggers[f"{unit_tbl}_ad"] = (f"AFTER DELETE ON {unit_tbl}", "= OLD.ppt_id")
+    for name, (event, cond) in triggers.items():
+        db.execute(f"DROP TRIGGER IF EXISTS ppt_versions_{name}")
+        db.execute(
+            f"CREATE TRIGGER ppt_versions_{name} {event} "
+            f"BEGIN {_ppt_versions_bump.format(cond=cond)} END"
+        )
+
+
+def _add_ppt_search_streets_trigger():
+    """Refresh street names in ppt_search on street renames."""
+    ppts = (
+        "IN (SELECT id FROM properties WHERE adrs_id IN "
+        "(SELECT id FROM addresses WHERE street_id = NEW.id))"
+    )
+    db.execute("DROP TRIGGER IF EXISTS ppt_search_streets_au")
+    db.execute(
+        "CREATE TRIGGER ppt_search_streets_au AFTER UPDATE OF name ON streets "
+        f"BEGIN {_ppt_search_refresh(ppts)} END"
+    )
+
+
+def _clear_invalid_locations():
+    """
+    Clear lat/lng and the R*Tree row of addresses which location is set to
+    NULL or invalid json, they were kept at the old position before.
+    ppt_search triggers are recreated with json_valid checks too.
+    """
+    set_lat_lng = f"""
+    UPDATE addresses SET
+    lat = {_location_coord.format(loc="NEW.location", k="lat")},
+    lng = {_location_coord.format(loc="NEW.location", k="lng")}
+    WHERE id = NEW.id;
+    """
+    triggers = {
+        "location_ai": f"AFTER INSERT ON addresses BEGIN {set_lat_lng} END",
+        "location_au": f"AFTER UPDATE OF location ON addresses BEGIN {set_lat_lng} END",
+    }
+    for name, body in triggers.items():
+        db.execute(f"DROP TRIGGER IF EXISTS addresses_{name}")
+        db.execute(f"CREATE TRIGGER addresses_{name} {body}")
+    _create_ppt_search_triggers()
+    _add_ppt_search_streets_trigger()
+    # rtree and ppt_search rows are updated by triggers
+    with db.conn:
+        db.execute("""
+            UPDATE addresses SET lat = NULL, lng = NULL
+            WHERE json_valid(location) IS NOT 1
+            AND (lat IS NOT NULL OR lng IS NOT NULL)
+            """)
+
+
+def _drop_name_norm_triggers():
+    """
+    name_norm is set by the app, see set_name_norm. Triggers calling the
+    python normalize_name broke writes of every other connection.
+    """
+    for name in NAME_NORM_TABLES:
+        for trg in ("ai", "au"):
+            db.execute(f"DROP TRIGGER IF EXISTS {name}_name_norm_{trg}")
+
+
+# Numbered schema migrations. Never reorder or remove items, append new ones.
+# Applied version is stored in `PRAGMA user_version`.
+MIGRATIONS = (
+    _initialize_db,
+    _add_indexes,
+    _create_ppt_search,
+    _add_ppt_search_location_index,
+    _add_address_coordinates,
+    _create_ppt_clusters,
+    _add_name_norm,
+    _add_unique_name_norm,
+    _create_ppt_versions,
+    _create_ppt_image_variants,
+    _add_file_checksums,
+    _add_ppt_images_name_index,
+    _create_geocodes,
+    _create_geocode_queue,
+    _add_address_geocoded,
+    _add_ppt_versions_triggers,
+    _add_ppt_search_streets_trigger,
+    _clear_invalid_locations,
+    _drop_name_norm_triggers,
+)
+
+
+def _get_schema_version() -> int:
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _migrate():
+    """Apply migrations which are newer than the database schema version."""
+    version = _get_schema_version()
+    for n, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        migration()
+        db.execute(f"PRAGMA user_version = {n}")
+
+
+_migrate()
 
 PPT_UNIT_TABLES = {
     PropertyType.WAREHOUSE: warehouses,
@@ -0,0 +1,336 @@
+import const
+import images
+from reportlab import rl_config
+from reportlab.lib import colors
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from reportlab.platypus import Paragraph, Table, TableStyle
+
+# Shared by all pdfs of the process, filled by init_assets
+_assets = {}
+
+
+def init_assets() -> None:
+    """
+    Register font and build styles once per process. Used as pdf_jobs
+    pool initializer, so workers are warm before the first job.
+    """
+    if _assets:
+        return
+    # JPEGs are embedded as is. ASCII85 encoding of the backgrounds and
+    # photos in pure python took most of the render time.
+    rl_config.useA85 = 0
+    pdfmetrics.registerFont(TTFont("Poppins", const.PDF_FONT))
+    _assets["paragraph_style"] = ParagraphStyle(
+        name="Custom",
+        fontName="Poppins",  # Use Poppins font or your preferred font
+        fontSize=25,  # Set desired font size here
+        leading=28,  # Set line height (optional)
+        # alignment=1,  # Center align (optional)
+    )
+    _assets["summary_style"] = TableStyle(
+        [
+            (
+                "BACKGROUND",
+                (0, 0),
+                (-1, 1),
+                colors.lightblue,
+            ),  # Header background color
+            ("TEXTCOLOR", (0, 0), (-1, 1), colors.whitesmoke),  # Header text color
+            ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+            ("FONTNAME", (0, 0), (-1, -1), "Poppins"),
+            ("FONTSIZE", (0, 0), (-1, -1), 46),  # Increased font size
+            (
+                "VALIGN",
+                (0, 0),
+                (-1, -1),
+                "TOP",
+            ),  # Align text to the top of the cell
+            # ('BOTTOMPADDING', (0, 0), (-1, -1), 16),
+            ("BACKGROUND", (0, 2), (-1, -1), colors.beige),  # Body background color
+            ("GRID", (0, 0), (-1, -1), 1, colors.black),
+        ]
+    )
+    _assets["detail_style"] = TableStyle(
+        [
+            (
+                "BACKGROUND",
+                (0, 0),
+                (0, -1),
+                colors.lightblue,
+            ),  # Header background color
+            (
+                "TEXTCOLOR",
+                (0, 0),
+                (0, -1),
+                colors.whitesmoke,
+            ),  # Header text color
+            ("ALIGN", (0, 0), (-1, -1), "LEFT"),
+            ("FONTNAME", (0, 0), (-1, -1), "Poppins"),
+            ("FONTSIZE", (0, 0), (-1, -1), 26),  # Increased font size
+            (
+                "VALIGN",
+                (0, 0),
+                (-1, -1),
+                "TOP",
+            ),  # Align text to the top of the cell
+            ("BOTTOMPADDING", (0, 0), (-1, -1), 30),
+            (
+                "BACKGROUND",
+                (1, 0),
+                (1, -1),
+                colors.beige,
+            ),  # Body background color
+            ("GRID", (0, 0), (-1, -1), 1, colors.black),
+        ]
+    )
+    _assets["infr_style"] = TableStyle(
+        [
+            (
+                "BACKGROUND",
+                (1, 0),
+                (-1, -1),
+                colors.transparent,
+            ),  # Body background color
+            ("GRID", (0, 0), (-1, -1), 0, colors.transparent),
+        ]
+    )
+
+
+def render_pdf(tbl, locations: list, db_imgs: list, output_pdf) -> None:
+    """
+    Create pdf using reportlab. Pure CPU work without db access,
+    runs in pdf_jobs worker processes.
+    """
+    init_assets()
+    # Create a PPTF
+    pdf_canvas = canvas.Canvas(
+        output_pdf, pagesize=(const.PAGE_WIDTH, const.PAGE_HEIGHT), pageCompression=1
+    )
+    # First page
+    pdf_canvas.drawImage(
+        const.COVER_BGD, 0, 0, width=const.PAGE_WIDTH, height=const.PAGE_HEIGHT
+    )
+    pdf_canvas.setFont("Poppins", 60)
+    pdf_canvas.setFillColor(colors.white)
+    pdf_canvas.drawString(const.LR_PADDING, const.TOP_PADDING, "Opções para locação")
+    pdf_canvas.drawString(const.LR_PADDING, const.TOP_PADDING - 60, "Limeira e região")
+
+    # Bookmark the first page and add an outline entry
+    pdf_canvas.bookmarkPage("first_page")
+    pdf_canvas.addOutlineEntry("Cover", "first_page", level=0)
+
+    pdf_canvas.showPage()
+
+    # About page
+    pdf_canvas.drawImage(
+        const.ABOUT_BGD, 0, 0, width=const.PAGE_WIDTH, height=const.PAGE_HEIGHT
+    )
+
+    # Bookmark the about page and add an outline entry
+    pdf_canvas.bookmarkPage("about_page")
+    pdf_canvas.addOutlineEntry("About", "about_page", level=0)
+
+    pdf_canvas.showPage()
+
+    # Step 1: Define a form XObject for the background
+    pdf_canvas.beginForm("background_form")
+    pdf_canvas.drawImage(
+        const.BODY_BGD, 0, 0, width=const.PAGE_WIDTH, height=const.PAGE_HEIGHT
+    )
+    pdf_canvas.endForm()
+
+    # Second page (static map and links)
+    pdf_canvas.doForm("background_form")
+
+    # Insert static map
+    pdf_canvas.drawImage(const.static_map_image, 400, 200, width=1200, height=800)
+
+    locations_list = (
+        (
+            f"Imóvel_{i['index']:02d}",
+            f"https://www.google.com/maps?q={i['location']['lat']},{i['location']['lng']}",
+        )
+        for i in locations
+        if i["location"]
+    )
+    # Add "See on map" links
+    y_position = 150
+    pdf_canvas.setFont("Poppins", 40)
+    pdf_canvas.drawString(400, y_position, "See on map:")
+    w = 250
+    for idx, (label, url) in enumerate(locations_list, start=1):
+        pdf_canvas.drawString(400 + idx * w, y_position, label)
+        pdf_canvas.linkURL(
+            url, (400 + idx * w, y_position, 400 + idx * w + w, y_position + 40)
+        )
+
+    # Bookmark the map page and add an outline entry
+    pdf_canvas.bookmarkPage("map_page")
+    pdf_canvas.addOutlineEntry("Map and Locations", "map_page", level=0)
+
+    pdf_canvas.showPage()
+
+    # Add Table Page (with 2.jpg background)
+    pdf_canvas.doForm("background_form")
+
+    custom_style = _assets["paragraph_style"]
+    # Convert the table headers and rows to Paragraphs
+    data = []
+    header_row = [Paragraph("Imóvel", custom_style)] + [
+        Paragraph(f"{i + 1:02d}", custom_style) for i in tbl.columns
+    ]
+    data.append(header_row)
+    # Convert each row of the table to Paragraphs
+    for index, row in tbl.iterrows():
+        row_data = [Paragraph(str(index), custom_style)] + [
+            Paragraph(str(cell), custom_style) for cell in row
+        ]
+        data.append(row_data)
+
+    # Dynamically calculate column widths based on page size and padding
+    available_width = const.PAGE_WIDTH - 2 * const.LR_PADDING
+    col_width = available_width / len(data[0])
+    tbl_width = [col_width] * len(data[0])
+
+    # Create a table with dynamically calculated column widths
+    table = Table(data, colWidths=tbl_width)
+
+    table.setStyle(_assets["summary_style"])
+
+    # Table height for calculating col positions (assumes uniform col heights)
+    first_col_y = (
+        const.PAGE_HEIGHT - const.TOP_PADDING
+    )  # Starting y-position for the first col
+    col_height = 40
+
+    # Add links manually for the first column cols
+    for col_idx in tbl.columns:
+        header_number = f"{col_idx + 1:02d}"
+
+        # Calculate the y position of each col's cell
+        col_x_position = const.LR_PADDING + (col_idx + 1) * col_width
+
+        # Define the clickable rectangle (adjust left/right as needed)
+        link_rect = (
+            col_x_position,
+            first_col_y,
+            col_x_position + col_width,
+            first_col_y - col_height,
+        )
+
+        # Add the clickable area linking to the bookmark
+        pdf_canvas.linkRect(header_number, header_number, link_rect)
+
+    # Wrap and draw the table
+    table_width, table_height = table.wrap(
+        const.PAGE_WIDTH, const.PAGE_HEIGHT - const.TOP_PADDING
+    )
+    table.drawOn(
+        pdf_canvas,
+        const.LR_PADDING,
+        const.PAGE_HEIGHT - const.TOP_PADDING - table_height,
+    )
+
+    # Bookmark the table page and add an outline entry
+    pdf_canvas.bookmarkPage("table_page")
+    pdf_canvas.addOutlineEntry("Table Overview", "table_page", level=0)
+
+    pdf_canvas.showPage()
+
+    # Add Dynamic Pages for each comparison
+    for idx in tbl.columns:
+        header_number = f"{idx + 1:02d}"
+
+        # Bookmark each row dynamically and add to the outline
+        pdf_canvas.bookmarkPage(header_number)
+        pdf_canvas.addOutlineEntry(
+            f"Details for Column {idx + 1}", header_number, level=1
+        )
+
+        # Create two pages for each row
+        pdf_canvas.doForm("background_form")
+        pdf_canvas.setFont("Poppins", 40)
+        pdf_canvas.drawString(
+            const.LR_PADDING,
+            const.PAGE_HEIGHT - const.TOP_PADDING + 100,
+            f"Imóvel {idx + 1:02d}",
+        )
+
+        column_data = tbl.column(idx)  # list of [label, value] pairs
+        table1 = Table(column_data[:-5], colWidths=[350] * 2)
+        table1.setStyle(_assets["detail_style"])
+        # Wrap and draw the table
+        table1_width, table1_height = table1.wrap(
+            const.PAGE_WIDTH, const.PAGE_HEIGHT - const.TOP_PADDING
+        )
+        table1.drawOn(
+            pdf_canvas,
+            const.LR_PADDING,
+            const.PAGE_HEIGHT - const.TOP_PADDING - table1_height,
+        )
+        table2 = Table(column_data[-5:], colWidths=[350] * 2)
+        table2.setStyle(_assets["detail_style"])
+        # Wrap and draw the table
+        table2_width, table2_height = table2.wrap(
+            const.PAGE_WIDTH, const.PAGE_HEIGHT - const.TOP_PADDING
+        )
+        table2.drawOn(
+            pdf_canvas,
+            const.LR_PADDING + 1000,
+            const.PAGE_HEIGHT - const.TOP_PADDING - table2_height - 300,
+        )
+
+        img_list = db_imgs[idx]["img"].split(",")
+        infr_list = db_imgs[idx]["infr"].split(",")
+
+        if img_list:
+            pdf_canvas.drawImage(
+                images.pdf_variant(img_list[0][1:]),
+                const.LR_PADDING + 1000,
+                const.PAGE_HEIGHT - const.TOP_PADDING - 300,
+                width=700,
+                height=300,
+            )
+        pdf_canvas.showPage()
+        pdf_canvas.doForm("background_form")
+        for i in range(1, 3):
+            try:
+                pdf_canvas.drawImage(
+                    images.pdf_variant(img_list[i][1:]),
+                    const.LR_PADDING,
+                    const.PAGE_HEIGHT - const.TOP_PADDING - 330 * i,
+                    width=700,
+                    height=300,
+                )
+            except IndexError:
+                break
+        col = [[Paragraph("Infraestrutura:", custom_style)]] + [
+            [Paragraph(f"•  {c}", custom_style)] for c in infr_list
+        ]
+        table3 = Table(col, colWidths=const.PAGE_WIDTH / 2 - const.LR_PADDING)
+        table3.setStyle(_assets["infr_style"])
+        # Wrap and draw the table
+        table3_width, table3_height = table3.wrap(
+            const.PAGE_WIDTH, const.PAGE_HEIGHT - const.TOP_PADDING
+        )
+        table3.drawOn(
+            pdf_canvas,
+            const.PAGE_WIDTH / 2,
+            const.PAGE_HEIGHT - const.TOP_PADDING - table3_height,
+        )
+
+        pdf_canvas.showPage()
+    # Last page (background 1.jpg)
+    pdf_canvas.drawImage(
+        const.LAST_PAGE_BGD, 0, 0, width=const.PAGE_WIDTH, height=const.PAGE_HEIGHT
+    )
+
+    # Bookmark the last page and add an outline entry
+    pdf_canvas.bookmarkPage("last_page")
+    pdf_canvas.addOutlineEntry("Last Page", "last_page", level=0)
+
+    # Save the PPTF
+    pdf_canvas.save()
@@ -0,0 +1,63 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import const
+
+# Rendered comparison pdfs named by the hash of their source data.
+# mtime is the last access time, the least recently used are evicted.
+const.PDF_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+
+def get_key(ppt_type: int, ad_type: int, rows: list) -> str:
+    """
+    Cache key of a comparison pdf. rows identify the comparisons, their
+    units with last_update and the ppt_versions of their properties.
+    """
+    src = [const.PDF_LAYOUT_VERSION, ppt_type, ad_type, rows]
+    return hashlib.sha256(json.dumps(src).encode()).hexdigest()
+
+
+def get_path(key: str) -> Path:
+    return const.PDF_CACHE_DIR / f"{key}.pdf"
+
+
+def get(key: str) -> Path | None:
+    """Path of the cached pdf or None. Marks the pdf as recently used."""
+    path = get_path(key)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def put(key: str, pdf: bytes) -> None:
+    """
+    Store the pdf. It is written to a temp file first, so a half written
+    pdf is never served. Then the cache is evicted down to its size.
+    """
+    path = get_path(key)
+    tmp = path.with_name(f"{key}.{os.getpid()}.tmp")
+    tmp.write_bytes(pdf)
+    os.replace(tmp, path)
+    evict()
+
+
+def evict(max_bytes: int = const.PDF_CACHE_MAX_BYTES) -> None:
+    """Remove least recently used pdfs until the cache fits in max_bytes."""
+    files = []
+    for entry in os.scandir(const.PDF_CACHE_DIR):
+        if entry.name.endswith(".pdf"):
+            try:
+                st = entry.stat()
+            except FileNotFoundError:  # removed by another worker
+                continue
+            files.append((st.st_mtime, st.st_size, entry.path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        Path(path).unlink(missing_ok=True)
+        total -= size
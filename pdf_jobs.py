@@ -0,0 +1,101 @@
+import asyncio
+import io
+import multiprocessing
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import const
+import pdf_builder
+import pdf_cache
+
+
+class QueueFull(Exception):
+    """Too many pdf jobs are pending."""
+
+
+class Job:
+    def __init__(self, user_id: int, key: str, filename: str, future):
+        self.user_id = user_id
+        self.key = key
+        self.filename = filename
+        self.future = future
+        self.finished = None  # time when the pdf was rendered or failed
+        future.add_done_callback(self._done)
+
+    def _done(self, future) -> None:
+        self.finished = time.monotonic()
+
+
+_executor = None
+jobs: dict[str, Job] = {}
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    """
+    Worker processes are spawned on first use. Spawn doesn't copy the db
+    connections and threads of the web process. Workers import this module,
+    pdf_builder, pdf_cache, images and const, and the __main__ script:
+    started with uvicorn main:app they don't import main and mysettings.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=const.PDF_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=pdf_builder.init_assets,
+        )
+    return _executor
+
+
+def _render(key: str, *render_args) -> None:
+    """Worker process function. Render pdf in memory and store it in pdf_cache."""
+    buf = io.BytesIO()
+    pdf_builder.render_pdf(*render_args, buf)
+    pdf_cache.put(key, buf.getvalue())
+
+
+def _purge() -> None:
+    """Forget jobs finished more than PDF_JOB_TTL ago."""
+    now = time.monotonic()
+    for job_id, job in list(jobs.items()):
+        if job.finished and now - job.finished > const.PDF_JOB_TTL:
+            discard(job_id)
+
+
+def submit(user_id: int, filename: str, key: str, *render_args) -> str:
+    """
+    Render pdf with pdf_cache key in a worker process. Return job id,
+    the id of a running job of the user is reused for the same key.
+    """
+    _purge()
+    running = {k: job for k, job in jobs.items() if not job.future.done()}
+    for job_id, job in running.items():
+        if job.key == key and job.user_id == user_id:
+            return job_id
+    if len(running) >= const.PDF_QUEUE_SIZE:
+        raise QueueFull
+    job_id = uuid.uuid4().hex
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(_get_executor(), _render, key, *render_args)
+    jobs[job_id] = Job(user_id, key, filename, future)
+    return job_id
+
+
+def get(job_id: str, user_id: int) -> Job | None:
+    """Job of the user or None."""
+    job = jobs.get(job_id)
+    if job is None or job.user_id != user_id:
+        return None
+    return job
+
+
+async def wait(job: Job, timeout: float) -> bool:
+    """Wait for the job at most timeout seconds. Return True if finished."""
+    await asyncio.wait({job.future}, timeout=timeout)
+    return job.future.done()
+
+
+def discard(job_id: str) -> None:
+    """Forget the job, its pdf stays in pdf_cache."""
+    jobs.pop(job_id, None)
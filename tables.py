@@ -0,0 +1,49 @@
+from typing import Callable, Iterator
+
+
+class UnitsTable:
+    """
+    Units of properties as columns and their fields as labeled rows, the
+    layout of the property and comparison tables. Cells are strings.
+    Plain lists only, so it is cheap to pickle for the pdf workers.
+    """
+
+    def __init__(self, labels: list[str], rows: list[list[str]]):
+        self.labels = labels
+        self.rows = rows
+
+    @classmethod
+    def build(cls, units: list[dict], fields: list[tuple[str, Callable]]):
+        """Table of the units with (label, formatter of a unit) fields."""
+        return cls(
+            [label for label, _ in fields],
+            [[_cell(fmt(unit)) for unit in units] for _, fmt in fields],
+        )
+
+    @property
+    def columns(self) -> range:
+        """Indexes of the units."""
+        return range(len(self.rows[0]) if self.rows else 0)
+
+    def iterrows(self) -> Iterator[tuple[str, list[str]]]:
+        """Label and cells of every field."""
+        return zip(self.labels, self.rows)
+
+    def column(self, idx: int) -> list[list[str]]:
+        """[label, cell] pairs of the unit."""
+        return [[label, row[idx]] for label, row in self.iterrows()]
+
+    def to_html(self) -> str:
+        """Table without header, cells are inserted as html."""
+        trs = "".join(
+            "    <tr>\n"
+            f"      <th>{label}</th>\n"
+            + "".join(f"      <td>{cell}</td>\n" for cell in row)
+            + "    </tr>\n"
+            for label, row in self.iterrows()
+        )
+        return f'<table border="1" class="dataframe">\n  <tbody>\n{trs}  </tbody>\n</table>'
+
+
+def _cell(value) -> str:
+    return "" if value is None else str(value)